@@ -0,0 +1,67 @@
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+
+from chest.models import Position, Color
+from chest.evaluate import iterative_deepening
+from chest.search import SearchContext
+from chest.transposition import TranspositionTable
+from chest.utils import move_name
+
+SUITE = [
+    ('r3k2r/p1pp1pb1/bn2pnp1/3P4/1p2P3/2N2Q1p/PPPBBPPP/R3K2R', Color.white),
+    ('rnbqkbnr/8/8/8/8/8/8/RNBQKBNR', Color.white),
+    ('r3k2r/8/8/3q4/8/8/3Q4/R3K2R', Color.black),
+    ('1k1r4/1pp4p/p7/4b3/8/P5P1/1PP2q2/1K1RR3', Color.white),
+    ('K7/8/7R/8/3rrrr1/8/ppp5/k7', Color.white),
+    ('2r3k1/5ppp/8/3b4/8/2Q5/5PPP/1R4K1', Color.white),
+    ('4k3/8/3q4/8/2B5/8/3R4/4K3', Color.black),
+]
+
+OPTIONS = ('null_move', 'reductions', 'aspiration')
+
+
+def run(options: dict, depth: int, tt_mb: float):
+    # every position is searched from scratch, so node counts don't depend on
+    # which options ran before
+    nodes, moves = 0, []
+    start = perf_counter()
+    for fen, color in SUITE:
+        ctx = SearchContext(tt=TranspositionTable(tt_mb), **options)
+        pos = Position.from_fen(fen)
+        move, score, _ = iterative_deepening(pos, color, depth, ctx=ctx)
+        nodes += ctx.nodes
+        moves.append((move_name(pos, move) if move else None, score))
+    return nodes, perf_counter() - start, moves
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.bench',
+                            description='nodes saved by each selective search option on a fixed suite')
+    parser.add_argument('options', nargs='*', metavar='option',
+                        help=f"options to measure one at a time: {', '.join(OPTIONS)} (default: all)")
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--hash', type=float, default=16, help='transposition table size in MB')
+    args = parser.parse_args(argv)
+    for name in args.options:
+        if name not in OPTIONS:
+            parser.error(f"unknown option {name!r}")
+    names = args.options or OPTIONS
+
+    base_nodes, base_seconds, base_moves = run({}, args.depth, args.hash)
+    print(f"baseline: {base_nodes} nodes in {base_seconds:.2f}s")
+    runs = [(name, {name: True}) for name in names]
+    if len(names) > 1:
+        runs.append(('+'.join(names), {name: True for name in names}))
+    for name, options in runs:
+        nodes, seconds, moves = run(options, args.depth, args.hash)
+        changed = [f"{fen} {a[0]} ({a[1]}) -> {b[0]} ({b[1]})" for (fen, _), a, b in zip(SUITE, base_moves, moves) if a != b]
+        print(f"{name}: {nodes} nodes in {seconds:.2f}s, saves {base_nodes - nodes} "
+              f"({1 - nodes / base_nodes:.1%}); {len(changed)} of {len(SUITE)} results differ")
+        for line in changed:
+            print(f"  {line}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
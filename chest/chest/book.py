@@ -0,0 +1,333 @@
+import mmap
+import re
+import struct
+import sys
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+from random import Random
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from chest.models import Position, Color
+from chest.geometry import geometry, KING_DIRECTIONS, STRAIGHT_DIRECTIONS, DIAGONAL_DIRECTIONS
+from chest.transposition import encode_move, decode_move
+from chest.utils import calculate_moves, move_name
+from chest.zobrist import BLACK_TO_MOVE, board_key, search_key
+
+# An opening book: the moves played from each position in the first plies of
+# a collection of PGN games, with how well they did. Positions are keyed as
+# the search keys them, by zobrist key with the side to move folded in, so a
+# lookup is a binary search over the memory-mapped keys.
+#
+# Games are replayed with the full rules of chess, castling, en passant and
+# promotion included, but only plain moves of a piece from one square to
+# another are recorded, and a book move the engine's own rules don't allow
+# (a knight's or a pawn's, say) is passed over when the book is probed.
+#
+# File layout: header, then the keys in order, then a move and a weight for
+# each key. A position with several moves has one key per move, best first.
+MAGIC = b'CHBK'
+VERSION = 1
+# magic, version, plies read from each game, entries, and a zobrist key so
+# that a file written with other keys isn't trusted
+HEADER = struct.Struct('<4sHHQQ')
+HEADER_BYTES = 32
+ENTRY_BYTES = 8 + 2 + 2
+DEFAULT_PATH = Path(__file__).with_name('book.bin')
+DEFAULT_PLIES = 24
+MAX_WEIGHT = 0xFFFF
+
+# points for white and black: a win counts twice a draw, a loss nothing
+RESULT_POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1), '*': (1, 1)}
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w'
+SIZE = 8
+GEO = geometry(SIZE, SIZE)
+SLIDES = {'r': STRAIGHT_DIRECTIONS, 'b': DIAGONAL_DIRECTIONS, 'q': KING_DIRECTIONS}
+
+SAN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+TOKEN = re.compile(r'''
+    \[\s*(?P<tag>\w+)\s+"(?P<value>(?:[^"\\]|\\.)*)"\s*\]
+  | (?P<result>1-0|0-1|1/2-1/2|\*)
+  | (?P<move>(?:[NBRQK]?[a-h]?[1-8]?x?[a-h][1-8](?:=?[NBRQ])?|[O0]-[O0](?:-[O0])?)[+#!?]*)
+  | (?P<open>\() | (?P<close>\))
+  | \{[^}]*\} | ;[^\n]* | \$\d+ | \d+\.* | \S
+''', re.VERBOSE)
+
+
+def square(name: str) -> int:
+    return SIZE * (SIZE - int(name[1])) + ord(name[0]) - 97
+
+
+def _reaches(board: List[str], start: int, end: int) -> bool:
+    # whether the piece on start attacks end
+    piece = board[start].lower()
+    if piece == 'p':
+        forward = -1 if board[start].isupper() else 1
+        return end // SIZE - start // SIZE == forward and abs(end % SIZE - start % SIZE) == 1
+    if piece == 'n':
+        return end in GEO.knight_jumps[start]
+    if piece == 'k':
+        return end in GEO.king_steps[start]
+    for direction in SLIDES[piece]:
+        for s in GEO.rays[direction][start]:
+            if s == end:
+                return True
+            if board[s]:
+                break
+    return False
+
+
+def _in_check(board: List[str], white: bool) -> bool:
+    king = board.index('K' if white else 'k')
+    return any(c and c.isupper() != white and _reaches(board, idx, king) for idx, c in enumerate(board))
+
+
+class Game:
+    # a game of standard chess, replayed from its moves in SAN
+    def __init__(self, fen: str = START_FEN):
+        fields = fen.split()
+        self.board = ['' for _ in range(SIZE * SIZE)]
+        for row_idx, row in enumerate(fields[0].split('/')):
+            column = 0
+            for c in row:
+                if c.isdigit():
+                    column += int(c)
+                else:
+                    self.board[SIZE * row_idx + column] = c
+                    column += 1
+        self.white = fields[1:2] != ['b']
+        self.en_passant = square(fields[3]) if len(fields) > 3 and fields[3] != '-' else None
+
+    def key(self) -> int:
+        return board_key(self.board) ^ (0 if self.white else BLACK_TO_MOVE)
+
+    def _can_move(self, start: int, end: int) -> bool:
+        board = self.board
+        if board[end] and board[end].isupper() == self.white:
+            return False
+        if board[start] not in 'Pp':
+            return _reaches(board, start, end)
+        forward = -SIZE if self.white else SIZE
+        if end % SIZE != start % SIZE:
+            return _reaches(board, start, end) and (board[end] != '' or end == self.en_passant)
+        home = SIZE - 2 if self.white else 1
+        return not board[end] and (end == start + forward or end == start + 2 * forward
+                                   and start // SIZE == home and not board[start + forward])
+
+    def _after(self, start: int, end: int) -> List[str]:
+        board = self.board.copy()
+        if board[start] in 'Pp' and end == self.en_passant and not board[end]:
+            board[end + (SIZE if self.white else -SIZE)] = ''
+        board[end], board[start] = board[start], ''
+        return board
+
+    def play(self, san: str) -> Optional[Tuple[int, int]]:
+        # the move as (start, end), or None for one the engine has no way of
+        # making: castling, en passant or a promotion
+        san = san.rstrip('+#!?').replace('0', 'O')
+        row = SIZE * (SIZE - 1 if self.white else 0)
+        if san in ('O-O', 'O-O-O'):
+            short = san == 'O-O'
+            king, rook = row + 4, row + (SIZE - 1 if short else 0)
+            between = range(king + 1, rook) if short else range(rook + 1, king)
+            if self.board[king] != ('K' if self.white else 'k') or self.board[rook] != ('R' if self.white else 'r') \
+                    or any(self.board[s] for s in between):
+                raise ValueError(f"can't castle {san}")
+            self.board[king + (2 if short else -2)], self.board[king + (1 if short else -1)] = \
+                self.board[king], self.board[rook]
+            self.board[king] = self.board[rook] = ''
+            self.white, self.en_passant = not self.white, None
+            return None
+        match = SAN.fullmatch(san)
+        if match is None:
+            raise ValueError(f"bad move {san!r}")
+        piece, file, rank, target, promotion = match.groups()
+        end = square(target)
+        piece = piece or 'P'
+        piece = piece if self.white else piece.lower()
+        starts = [start for start, c in enumerate(self.board) if c == piece
+                  and (file is None or start % SIZE == ord(file) - 97)
+                  and (rank is None or start // SIZE == SIZE - int(rank))
+                  and self._can_move(start, end) and not _in_check(self._after(start, end), self.white)]
+        if len(starts) != 1:
+            raise ValueError(f"{'ambiguous' if starts else 'illegal'} move {san!r}")
+        start = starts[0]
+        simple = not promotion and not (piece in 'Pp' and end == self.en_passant and not self.board[end])
+        self.board = self._after(start, end)
+        if promotion:
+            self.board[end] = promotion if self.white else promotion.lower()
+        two_squares = piece in 'Pp' and abs(end - start) == 2 * SIZE
+        self.en_passant = (start + end) // 2 if two_squares else None
+        self.white = not self.white
+        return (start, end) if simple else None
+
+
+def read_games(text: str) -> Iterator[Tuple[Dict[str, str], List[str]]]:
+    # the tags and main line of each game; comments and variations are dropped
+    tags, moves, depth = {}, [], 0
+    for token in TOKEN.finditer(text):
+        if token['tag']:
+            if moves:
+                yield tags, moves
+                tags, moves = {}, []
+            tags[token['tag']] = token['value']
+        elif token['open']:
+            depth += 1
+        elif token['close']:
+            depth = max(depth - 1, 0)
+        elif depth:
+            continue
+        elif token['result']:
+            tags.setdefault('Result', token['result'])
+            yield tags, moves
+            tags, moves = {}, []
+        elif token['move']:
+            moves.append(token['move'])
+    if moves:
+        yield tags, moves
+
+
+def build(paths: List[Path], plies: int = DEFAULT_PLIES, min_games: int = 1,
+          log=print) -> List[Tuple[int, int, int]]:
+    # (key, move, weight) for every move played in at least min_games games,
+    # sorted as they are stored
+    stats = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        for number, (tags, moves) in enumerate(read_games(text), 1):
+            if tags.get('Variant', 'Standard').lower() not in ('standard', 'chess'):
+                continue
+            points = RESULT_POINTS.get(tags.get('Result'), RESULT_POINTS['*'])
+            try:
+                game = Game(tags.get('FEN', START_FEN))
+                for san in moves[:plies]:
+                    key, white = game.key(), game.white
+                    move = game.play(san)
+                    if move is not None:
+                        entry = stats[key][move]
+                        entry[0] += 1
+                        entry[1] += points[0 if white else 1]
+            except (ValueError, IndexError) as e:
+                # what was read before the bad move is kept
+                log(f"{path}: game {number}: {e}")
+    return sorted(((key, encode_move(move), min(points, MAX_WEIGHT))
+                   for key, moves in stats.items() for move, (games, points) in moves.items()
+                   if games >= min_games and points > 0), key=lambda e: (e[0], -e[2], e[1]))
+
+
+def write(path: Path, entries: List[Tuple[int, int, int]], plies: int):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, plies, len(entries), BLACK_TO_MOVE).ljust(HEADER_BYTES, b'\0'))
+        for column, typecode in enumerate('QHH'):
+            array(typecode, (entry[column] for entry in entries)).tofile(f)
+
+
+class Book:
+    def __init__(self, path: Path = DEFAULT_PATH):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, plies, size, zobrist = HEADER.unpack(self.mm[:HEADER.size].ljust(HEADER.size, b'\0'))
+        if magic != MAGIC or version != VERSION or zobrist != BLACK_TO_MOVE \
+                or len(self.mm) != HEADER_BYTES + ENTRY_BYTES * size:
+            self.mm.close()
+            raise ValueError(f"{self.path} is not a version {VERSION} opening book")
+        self.plies = plies
+        self.size = size
+        view = memoryview(self.mm)
+        self.keys = view[HEADER_BYTES:HEADER_BYTES + 8 * size].cast('Q')
+        self.move_codes = view[HEADER_BYTES + 8 * size:HEADER_BYTES + 10 * size].cast('H')
+        self.weights = view[HEADER_BYTES + 10 * size:].cast('H')
+        self.view = view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.mm.closed:
+            return
+        for table in (self.keys, self.move_codes, self.weights, self.view):
+            table.release()
+        self.mm.close()
+
+    def __getstate__(self):
+        # worker processes map the file again rather than copying it
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def entries(self, key: int) -> List[Tuple[Tuple[int, int], int]]:
+        found = []
+        i = bisect_left(self.keys, key)
+        while i < self.size and self.keys[i] == key:
+            found.append((decode_move(self.move_codes[i]), self.weights[i]))
+            i += 1
+        return found
+
+    def moves(self, pos: Position, black: bool) -> List[Tuple[Tuple[int, int], int]]:
+        # the book's moves from pos that the engine can play, best first
+        if pos.board_width != SIZE or pos.board_height != SIZE:
+            return []
+        return [(move, weight) for move, weight in self.entries(search_key(pos.key, black, False))
+                if pos.board[move[0]] and pos.board[move[0]].isupper() != black
+                and move[1] in calculate_moves(pos, move[0])]
+
+    def choose(self, pos: Position, black: bool, rng: Optional[Random] = None) -> Optional[Tuple[int, int]]:
+        # the move that scored best, or with rng one drawn by weight
+        moves = self.moves(pos, black)
+        if not moves:
+            return None
+        if rng is None:
+            return moves[0][0]
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+
+def load_default() -> Optional[Book]:
+    return Book(DEFAULT_PATH) if DEFAULT_PATH.exists() else None
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.book',
+                            description='compile PGN games into an opening book, or probe one')
+    parser.add_argument('pgn', nargs='*', type=Path, help='games to read')
+    parser.add_argument('-o', '--output', type=Path, default=DEFAULT_PATH)
+    parser.add_argument('--plies', type=int, default=DEFAULT_PLIES, help='how far into each game to read')
+    parser.add_argument('--min-games', type=int, default=1, help='leave out moves played in fewer games')
+    parser.add_argument('--probe', metavar='FEN', help='look a position up instead of building')
+    parser.add_argument('--color', choices=[c.value for c in Color], default=Color.white.value)
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        pos = Position.from_fen(args.probe)
+        black = args.color == Color.black
+        with Book(args.output) as book:
+            moves = book.moves(pos, black)
+        if not moves:
+            print(f"{args.probe} is not in {args.output}")
+            return 1
+        total = sum(weight for _, weight in moves)
+        for move, weight in moves:
+            print(f"{move_name(pos, move)} {weight} ({weight / total:.0%})")
+        return 0
+
+    if not args.pgn:
+        parser.error('give PGN files to compile, or --probe a position')
+    start = perf_counter()
+    entries = build(args.pgn, args.plies, args.min_games)
+    write(args.output, entries, args.plies)
+    print(f"wrote {len(entries)} moves from {len({key for key, _, _ in entries})} positions to {args.output} "
+          f"in {perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
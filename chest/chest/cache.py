@@ -0,0 +1,71 @@
+from collections import namedtuple
+from functools import wraps
+from sys import getsizeof
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'currsize', 'bytes', 'max_bytes', 'evictions'])
+
+# a dict slot (hash, key and value pointers, plus index and spare room)
+# costs about this much on top of the key and value themselves
+SLOT_BYTES = 64
+
+_MISSING = (None, None, None)
+
+
+def zobrist_key(position) -> int:
+    return position.key
+
+
+def position_cache(max_mb: float, check=zobrist_key):
+    # Like lru_cache, but keyed on hash(position) rather than the position
+    # itself: positions are mutated in place by make_move, so they can't be
+    # kept around as dict keys. The key is one int, the position's hash
+    # mixed with the other arguments', so different calls can share a key;
+    # each entry also keeps check(position) (the full zobrist key, which
+    # hash() folds to 61 bits) and the arguments, and a hit needs both to match.
+    #
+    # Entries go into a young generation; once that holds half of max_mb it
+    # becomes the old generation and the previous old one is dropped. A hit
+    # in the old generation copies the entry back into the young one, so
+    # what's still in use survives and the total stays under max_mb.
+    def decorator(func):
+        half = max_mb * 2**20 / 2
+        young, old = {}, {}
+        young_bytes = old_bytes = hits = misses = evictions = 0
+
+        @wraps(func)
+        def wrapper(position, *args):
+            nonlocal young, old, young_bytes, old_bytes, hits, misses, evictions
+            key = hash(position) ^ hash(args)
+            word = check(position)
+            entry = young.get(key, _MISSING)
+            if entry[0] == word and entry[1] == args:
+                hits += 1
+                return entry[2]
+            entry = old.get(key, _MISSING)
+            if entry[0] == word and entry[1] == args:
+                hits += 1
+            else:
+                misses += 1
+                entry = word, args, func(position, *args)
+            young[key] = entry
+            young_bytes += getsizeof(key) + getsizeof(entry) + getsizeof(word) + getsizeof(args) \
+                + getsizeof(entry[2]) + SLOT_BYTES
+            if young_bytes > half:
+                evictions += len(old)
+                old, young = young, {}
+                old_bytes, young_bytes = young_bytes, 0
+            return entry[2]
+
+        def cache_info():
+            return CacheInfo(hits, misses, len(young) + len(old), young_bytes + old_bytes,
+                             int(max_mb * 2**20), evictions)
+
+        def cache_clear():
+            nonlocal young, old, young_bytes, old_bytes, hits, misses, evictions
+            young, old = {}, {}
+            young_bytes = old_bytes = hits = misses = evictions = 0
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
@@ -1,113 +1,414 @@
 from dataclasses import astuple
-from chest.models import Piece, Position, Color, piece_values
-from chest.utils import color_of_piece, calculate_moves
+from chest.models import Position, Color
+from chest.utils import color_of_piece, calculate_moves, calculate_captures, attack_map, is_attacked, SLIDER_DIRECTIONS
 from math import inf
 from datetime import datetime
-from collections import Counter
-from functools import lru_cache
+from typing import Optional
+from chest.cache import position_cache
+from chest.transposition import TranspositionTable, EXACT, LOWER, UPPER
+from chest.zobrist import search_key
+from chest.search import SearchContext, SearchTimeout, IterationInfo, SearchStats
+from chest.ordering import staged_moves, order_captures, record_cutoff, order_values
+from chest.vector import board_array, child_boards, score_boards
+from chest.tablebase import Tablebase
+from chest.book import Book
+from time import monotonic
+
+def generate_moves(pos: Position, black_to_move: bool):
+    pieces = pos.black_pieces if black_to_move else pos.white_pieces
+    return [(idx, move) for _, idx in pieces for move in calculate_moves(pos, idx)]
+
+
+def generate_captures(pos: Position, black_to_move: bool):
+    pieces = pos.black_pieces if black_to_move else pos.white_pieces
+    return [(idx, move) for _, idx in pieces for move in calculate_captures(pos, idx)]
+
+# Evaluation is material only, so a capture can't gain more than the piece it
+# takes; the margin leaves room for a capture sequence that ends in mate.
+DELTA_MARGIN = 2
+
+# Scores are whole pawns, so (beta - 1, beta) is a null window.
+NULL_MOVE_REDUCTION = 2
+# quiet moves after the first LMR_FULL_MOVES are searched a ply shallower
+# first, and only searched in full if they turn out to raise alpha
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+ASPIRATION_WINDOW = 1
 
-def alpha_beta(pos: Position, counter: Counter, black: bool = False, max_depth: int = 3, depth: int = 0, alpha: float = -inf, beta: float = inf, maxing: bool = True):
-    if depth == max_depth:
-        return None, evaluate(pos, black)
 
-    if counter['pos'] % 1000 == 0:
-        print(f"evaluated {counter['pos']} positions")
+def may_pass(pos: Position, black_to_move: bool) -> bool:
+    # passing is only a safe lower bound for a side that isn't in check and
+    # has something other than its king to move
+    pieces = pos.black_pieces if black_to_move else pos.white_pieces
+    king = pos.black_king if black_to_move else pos.white_king
+    return any(p in SLIDER_DIRECTIONS for p, _ in pieces) and not in_check(pos, king)
 
-    board = evaluate(pos, black)
+
+def alpha_beta(pos: Position, ctx: SearchContext, black: bool = False, max_depth: int = 3, depth: int = 0, alpha: float = -inf, beta: float = inf, maxing: bool = True, null_ok: bool = True):
+    if ctx.tablebase is not None and depth > 0:
+        score = tablebase_score(pos, ctx, black, maxing)
+        if score is not None:
+            ctx.visit()
+            return None, score
+    if depth == max_depth and ctx.quiescence:
+        return None, quiescence(pos, ctx, black, alpha, beta, maxing)
+    ctx.visit()
+    if depth == max_depth:
+        with ctx.phase('evaluate'):
+            return None, evaluate(pos, black)
+
+    counter, tt = ctx.counter, ctx.tt
+    with ctx.phase('evaluate'):
+        board = evaluate(pos, black)
     if board == inf or board == -inf:
 
         return None, board
 
-    if black:
-        pieces = pos.black_pieces if maxing else pos.white_pieces
-    else:
-        pieces = pos.white_pieces if maxing else pos.black_pieces
+    remaining = max_depth - depth
+    key = search_key(pos.key, black == maxing, black)
+    tt_move = None
+    if tt is not None:
+        entry = tt.probe(key)
+        if ctx.stats is not None:
+            ctx.probed(entry is not None)
+        if entry is not None:
+            tt_depth, flag, score, tt_move = entry
+            # the root always searches so it has a move to return
+            if depth > 0 and tt_depth >= remaining and (
+                    flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha)):
+                counter['tt_cutoffs'] += 1
+                return tt_move, score
+
+    if ctx.null_move and null_ok and depth > 0 and remaining > NULL_MOVE_REDUCTION \
+            and (beta < inf if maxing else alpha > -inf) and may_pass(pos, black == maxing):
+        # let the other side move twice: if the score still falls outside the
+        # window, a real move would have done at least as well
+        if maxing:
+            _, score = alpha_beta(pos, ctx, black, max_depth - NULL_MOVE_REDUCTION, depth + 1, beta - 1, beta, False, False)
+            if score >= beta:
+                counter['null_cutoffs'] += 1
+                return None, beta
+        else:
+            _, score = alpha_beta(pos, ctx, black, max_depth - NULL_MOVE_REDUCTION, depth + 1, alpha, alpha + 1, True, False)
+            if score <= alpha:
+                counter['null_cutoffs'] += 1
+                return None, alpha
+
     comparator = (lambda a, v: v > a) if maxing else (lambda b, v: v < b)
 
     best_move = (0, 0)
+    node_move = None
+    alpha_orig, beta_orig = alpha, beta
 
     #print(pieces)
     value = -inf if maxing else inf
 
-    for p, idx in pieces:
-        moves = calculate_moves(pos, idx)
-        #print(f"{p} has these moves: {moves}")
-        positions = [(pos.perform_move(idx, move), move) for move in moves]
-        counter['pos'] += len(positions)
-        for new_pos, move in positions:
-
-            _, new_val = alpha_beta(new_pos, counter, black, max_depth, depth + 1, alpha, beta, not maxing)
-            #if move == 41:
-                #print(comparator(1, 2), maxing)
-                #print(f"{depth}: {new_pos.to_fen()}, new_val {new_val} eval: {evaluate(new_pos, black)}")
-            if comparator(value, new_val):
-                value = new_val
+    # children are only generated as the loop reaches them
+    moves = staged_moves(pos, ctx, black == maxing, depth, tt_move)
+    leaves = None
+    if ctx.batch_leaves and remaining == 1:
+        moves = list(moves)
+        with ctx.phase('evaluate'):
+            leaves = leaf_scores(pos, moves, black)
 
-            if maxing:
-                #print(f"compare {alpha} to {value}")
-                if value >= beta:
-                    break
-                if comparator(alpha, value):
-                    alpha = value
-                    #print(f"best_move {new_pos.to_fen()} rated {alpha} eval {evaluate(new_pos, black)}")
-                    best_move = (idx, move)
-                    if alpha == inf:
-                        print(new_pos.to_fen())
-                        print("hi")
-                        return best_move, alpha
-            else:
-                if value <= alpha:
+    for i, (idx, move) in enumerate(moves):
+        counter['pos'] += 1
+
+        reduce = ctx.reductions and i >= LMR_FULL_MOVES and remaining >= LMR_MIN_DEPTH \
+            and not pos.board[move] and (alpha > -inf if maxing else beta < inf)
+        pos.make_move(idx, move)
+        if leaves is None:
+            new_val = None
+            if reduce:
+                counter['reduced'] += 1
+                window = (alpha, alpha + 1) if maxing else (beta - 1, beta)
+                _, new_val = alpha_beta(pos, ctx, black, max_depth - 1, depth + 1, *window, not maxing)
+                if (new_val > alpha) if maxing else (new_val < beta):
+                    counter['re_searched'] += 1
+                    new_val = None
+            if new_val is None:
+                _, new_val = alpha_beta(pos, ctx, black, max_depth, depth + 1, alpha, beta, not maxing)
+        else:
+            new_val = leaf_value(pos, ctx, black, leaves[i], alpha, beta, not maxing)
+        pos.unmake_move()
+        #if move == 41:
+            #print(comparator(1, 2), maxing)
+            #print(f"{depth}: {new_pos.to_fen()}, new_val {new_val} eval: {evaluate(new_pos, black)}")
+        if comparator(value, new_val):
+            value = new_val
+            node_move = (idx, move)
+
+        if maxing:
+            #print(f"compare {alpha} to {value}")
+            if value >= beta:
+                # a mate at the root fails high against beta=inf too
+                best_move = node_move
+                record_cutoff(pos, ctx, (idx, move), depth, remaining, i)
+                break
+            if comparator(alpha, value):
+                alpha = value
+                #print(f"best_move {new_pos.to_fen()} rated {alpha} eval {evaluate(new_pos, black)}")
+                best_move = (idx, move)
+                if alpha == inf:
                     break
-                if comparator(beta, value):
-                    beta = value
+        else:
+            if value <= alpha:
+                record_cutoff(pos, ctx, (idx, move), depth, remaining, i)
+                break
+            if comparator(beta, value):
+                beta = value
+
+    if tt is not None:
+        if value <= alpha_orig:
+            flag = UPPER
+        elif value >= beta_orig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        tt.store(key, remaining, flag, value, node_move)
     return best_move, value
 
 
-def find_best_move(pos: Position, turn: Color, max_depth: int = 5):
+def leaf_scores(pos: Position, moves, black: bool):
+    # every child is a leaf: score them all in one batch. Mates are still
+    # found one child at a time as the loop reaches them.
+    if not moves:
+        return []
+    scores = score_boards(child_boards(board_array(pos), moves))
+    return (-scores if black else scores).tolist()
+
+
+def leaf_value(pos: Position, ctx: SearchContext, black: bool, score: int, alpha: float, beta: float, maxing: bool):
+    ctx.visit()
+    if ctx.tablebase is not None:
+        known = tablebase_score(pos, ctx, black, maxing)
+        if known is not None:
+            return known
+    terminal = _terminal(pos)
+    if terminal is not None:
+        return -terminal if black else terminal
+    if ctx.quiescence:
+        return quiescence(pos, ctx, black, alpha, beta, maxing, score)
+    return score
+
+
+def quiescence(pos: Position, ctx: SearchContext, black: bool, alpha: float, beta: float, maxing: bool,
+               stand_pat: Optional[float] = None):
+    # captures only, until the position is quiet. The side to move may also
+    # decline to capture, so the static evaluation is a bound to start from.
+    if stand_pat is None:
+        ctx.visit()
+        if ctx.tablebase is not None:
+            known = tablebase_score(pos, ctx, black, maxing)
+            if known is not None:
+                return known
+        with ctx.phase('evaluate'):
+            stand_pat = evaluate(pos, black)
+        if stand_pat == inf or stand_pat == -inf:
+            return stand_pat
+    ctx.counter['qnodes'] += 1
+    if maxing:
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+    else:
+        if stand_pat <= alpha:
+            return stand_pat
+        beta = min(beta, stand_pat)
+
+    with ctx.phase('movegen'):
+        moves = generate_captures(pos, black == maxing)
+    with ctx.phase('ordering'):
+        moves = order_captures(pos, moves)
+    board = pos.board
+    value = stand_pat
+    for idx, move in moves:
+        # delta pruning: captures come biggest victim first, so once one can't
+        # reach the window none of the rest can either
+        gain = order_values[board[move]] + DELTA_MARGIN
+        if (stand_pat + gain <= alpha) if maxing else (stand_pat - gain >= beta):
+            ctx.counter['delta_pruned'] += 1
+            break
+        pos.make_move(idx, move)
+        new_val = quiescence(pos, ctx, black, alpha, beta, not maxing)
+        pos.unmake_move()
+        if maxing:
+            if new_val > value:
+                value = new_val
+            if value >= beta:
+                break
+            alpha = max(alpha, value)
+        else:
+            if new_val < value:
+                value = new_val
+            if value <= alpha:
+                break
+            beta = min(beta, value)
+    return value
+
+
+def tablebase_score(pos: Position, ctx: SearchContext, black: bool, maxing: bool) -> Optional[float]:
+    # the tables score for the side to move: flip it when that's the minimizing side
+    score = ctx.tablebase.score(pos, black == maxing)
+    if score is None:
+        return None
+    ctx.counter['tb_hits'] += 1
+    return score if maxing else -score
+
+
+def principal_variation(pos: Position, tt: TranspositionTable, black: bool, max_depth: int):
+    pv = []
+    seen = set()
+    for depth in range(max_depth):
+        key = search_key(pos.key, black == (depth % 2 == 0), black)
+        entry = tt.probe(key)
+        if entry is None or entry[3] is None or key in seen:
+            break
+        start, end = entry[3]
+        if pos.board[start] == '' or end not in calculate_moves(pos, start):
+            break
+        seen.add(key)
+        pv.append(entry[3])
+        pos.make_move(start, end)
+    for _ in pv:
+        pos.unmake_move()
+    return pv
+
+
+def iterative_deepening(pos: Position, turn: Color, max_depth: int = 5, time_limit: Optional[float] = None,
+                        node_limit: Optional[int] = None, ctx: Optional[SearchContext] = None, on_iteration=None,
+                        root_search=None):
+    if root_search is None:
+        root_search = alpha_beta
+    if ctx is None:
+        ctx = SearchContext(tt=TranspositionTable())
+    if ctx.tt is None:
+        ctx.tt = TranspositionTable()
+    ctx.tt.new_search()
+    ctx.pv = []
+    ctx.set_budget(time_limit, node_limit)
+    limits = ctx.deadline, ctx.node_limit
+    black = turn == Color.black
+    root_ply = len(pos.history)
+    if ctx.tablebase is not None:
+        # a covered root is played straight from the tables, quickest mate first
+        known = ctx.tablebase.best_move(pos, black)
+        if known is not None:
+            ctx.counter['tb_hits'] += 1
+            move, score = known
+            ctx.pv = [move]
+            return move, score, []
+    stats = ctx.stats
+    if stats is not None:
+        started, caches = monotonic(), cache_infos()
+
+    best_move, best_score = None, -inf
+    iterations = []
+    for depth in range(1, max_depth + 1):
+        # the first iteration always finishes so there is a move to return
+        ctx.deadline, ctx.node_limit = limits if depth > 1 else (None, None)
+        start, nodes = monotonic(), ctx.nodes
+        try:
+            alpha, beta = -inf, inf
+            if ctx.aspiration and iterations and best_score not in (inf, -inf):
+                alpha, beta = best_score - ASPIRATION_WINDOW, best_score + ASPIRATION_WINDOW
+            while True:
+                move, score = root_search(pos, ctx, black, depth, alpha=alpha, beta=beta)
+                # outside the window the score is only a bound: open that side and search again
+                if alpha > -inf and score <= alpha:
+                    alpha = -inf
+                elif beta < inf and score >= beta:
+                    beta = inf
+                else:
+                    break
+                ctx.counter['aspiration_researches'] += 1
+        except SearchTimeout:
+            while len(pos.history) > root_ply:
+                pos.unmake_move()
+            break
+        best_move, best_score = move, score
+        ctx.pv = principal_variation(pos, ctx.tt, black, depth)
+        info = IterationInfo(depth, score, move, ctx.pv, ctx.nodes - nodes, monotonic() - start)
+        iterations.append(info)
+        if stats is not None:
+            stats.depth = depth
+        if on_iteration is not None:
+            on_iteration(info)
+        if score in (inf, -inf):
+            break
+    ctx.deadline = ctx.node_limit = None
+    if stats is not None:
+        stats.seconds += monotonic() - started
+        for name, info in cache_infos().items():
+            before = caches[name]
+            stats.caches[name] = info._replace(hits=info.hits - before.hits, misses=info.misses - before.misses)
+        ctx.report()
+    return best_move, best_score, iterations
+
+
+def print_iteration(info: IterationInfo):
+    print(f"depth {info.depth}: score {info.score} move {info.move} nodes {info.nodes} nps {info.nps:.0f}")
+
+
+def find_best_move(pos: Position, turn: Color, max_depth: int = 5, tt: Optional[TranspositionTable] = None,
+                   time_limit: Optional[float] = None, node_limit: Optional[int] = None, workers: int = 1,
+                   stats: Optional[SearchStats] = None, tablebase: Optional[Tablebase] = None,
+                   book: Optional[Book] = None, on_iteration=None):
     now = datetime.now()
-    c = Counter()
-    move, score = alpha_beta(pos, c, turn == Color.black, max_depth)
+    move = book.choose(pos, turn == Color.black) if book is not None else None
+    if move is not None:
+        print(f"book: {datetime.now() - now}")
+        return move[0], move[1]
+    ctx = SearchContext(tt=tt, stats=stats, tablebase=tablebase)
+    if workers > 1:
+        from chest.parallel import RootSplitter
+        with RootSplitter(workers, tablebase=tablebase.path if tablebase is not None else None) as splitter:
+            move, score, _ = iterative_deepening(pos, turn, max_depth, time_limit, node_limit,
+                                                 ctx, on_iteration, splitter.search)
+    else:
+        move, score, _ = iterative_deepening(pos, turn, max_depth, time_limit, node_limit,
+                                             ctx, on_iteration)
     print(f"time: {datetime.now() - now}")
     return move[0], move[1]
 
 def evaluate(pos: Position, black: bool = False):
     return _evaluate(pos) * (-1 if black else 1)
-@lru_cache(maxsize=6_000_000)
+@position_cache(max_mb=128)
 def _evaluate(pos: Position):
+    terminal = _terminal(pos)
+    if terminal is not None:
+        return terminal
+    return score_pieces(pos)
+
+
+def _terminal(pos: Position):
     # check checks
     
-    white_king_idx = next((p[1] for p in pos.white_pieces if p[0] == Piece.king), None)
+    white_king_idx = pos.white_king
     if white_king_idx is None:
         return - inf
-    black_king_idx = next((p[1] for p in pos.black_pieces if p[0] == Piece.king), None)
+    black_king_idx = pos.black_king
     if black_king_idx is None:
         return inf
 
-    white_in_check = in_check(pos, white_king_idx)
-    black_in_check = in_check(pos, black_king_idx)
-
-    white_king_moves = calculate_moves(pos, white_king_idx)
-    black_king_moves = calculate_moves(pos, black_king_idx)
-
-    if len(white_king_moves) == 0 and white_in_check:
+    # a king with somewhere to go isn't mated, so the attack map is only
+    # needed for kings that are boxed in
+    if len(calculate_moves(pos, white_king_idx)) == 0 and in_check(pos, white_king_idx):
         return - inf
-    if len(black_king_moves) == 0 and black_in_check:
+    if len(calculate_moves(pos, black_king_idx)) == 0 and in_check(pos, black_king_idx):
         return inf
 
-    return score_pieces(pos)
+    return None
 
 
 def score_pieces(pos: Position) -> int:
     # TODO scale by number of remaining pieces
-    white_score = sum(piece_values[Piece(p[0])] for p in pos.white_pieces)
-    black_score = sum(piece_values[Piece(p[0])] for p in pos.black_pieces)
-    return white_score - black_score
+    return pos.material
 
-@lru_cache(maxsize=6_000_000)
 def in_check(position: Position, king_idx: int):
-    color = color_of_piece(position.board[king_idx])
-    pieces = position.white_pieces if color == Color.black else position.black_pieces
-    for _, idx in pieces:
-        if king_idx in calculate_moves(position, idx):
-            return True
-    return False
\ No newline at end of file
+    enemy = Color.white if color_of_piece(position.board[king_idx]) == Color.black else Color.black
+    return is_attacked(position, king_idx, enemy)
+
+
+def cache_infos():
+    return {func.__name__: func.cache_info() for func in (calculate_moves, calculate_captures, attack_map, _evaluate)}
@@ -0,0 +1,40 @@
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+Direction = Tuple[int, int]
+
+STRAIGHT_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL_DIRECTIONS = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+KING_DIRECTIONS = tuple((i, j) for i in range(-1, 2) for j in range(-1, 2) if i != 0 or j != 0)
+KNIGHT_JUMPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+
+
+class Geometry:
+    # Squares reachable from every square of an empty width x height board,
+    # nearest first. Move generation walks these instead of checking edges.
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.squares = width * height
+        self.rays: Dict[Direction, Tuple[Tuple[int, ...], ...]] = {
+            d: tuple(self._ray(i, d) for i in range(self.squares)) for d in KING_DIRECTIONS}
+        self.king_steps = tuple(tuple(s for d in KING_DIRECTIONS for s in self.rays[d][i][:1])
+                                for i in range(self.squares))
+        self.knight_jumps = tuple(tuple(s for d in KNIGHT_JUMPS for s in self._ray(i, d, 1))
+                                  for i in range(self.squares))
+
+    def _ray(self, index: int, direction: Direction, limit: Optional[int] = None) -> Tuple[int, ...]:
+        x, y = index % self.width, index // self.width
+        squares = []
+        while limit is None or len(squares) < limit:
+            x += direction[0]
+            y += direction[1]
+            if not (0 <= x < self.width and 0 <= y < self.height):
+                break
+            squares.append(y * self.width + x)
+        return tuple(squares)
+
+
+@lru_cache(maxsize=None)
+def geometry(width: int, height: int) -> Geometry:
+    return Geometry(width, height)
@@ -0,0 +1,374 @@
+import os
+import re
+import subprocess
+import sys
+from argparse import ArgumentParser, FileType
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from itertools import count
+from math import isinf, log, log10
+from multiprocessing import Barrier
+from pathlib import Path
+from random import Random
+from threading import BrokenBarrierError
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from chest.models import Position, Color
+from chest.batch import parse_line
+from chest.evaluate import evaluate, generate_moves, in_check
+from chest.bench import SUITE
+
+# Games between two engines run over UCI, each engine in a process of its
+# own, so that chest can play chest2 (both are imported as `chest`) or one
+# configuration of an engine another. The board is kept here and sent as
+# a FEN each move; each engine plays by its own rules. A game ends when a
+# king is taken, when the side to move has no move (and so loses, as in
+# the search), or as a draw by repetition or after MAX_PLIES.
+#
+# With a depth or node limit both engines play the same game from the same
+# start every time, so after one pass over the openings each pair of games
+# starts RANDOM_PLIES random moves into one, and a start already played is
+# not played again.
+MAX_PLIES = 200
+RANDOM_PLIES = 4
+PACKAGE = Path(__file__).resolve().parent.parent
+
+INFO_DEPTH = re.compile(r'\bdepth (\d+)')
+INFO_NODES = re.compile(r'\bnodes (\d+)')
+
+
+@dataclass
+class EngineSpec:
+    # a package directory holding chest/uci.py, and UCI options to set
+    path: Path
+    options: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, text: str) -> 'EngineSpec':
+        # DIR or DIR:Name=value,Name=value
+        path, _, options = text.partition(':')
+        spec = cls(Path(path))
+        for option in filter(None, options.split(',')):
+            name, sep, value = option.partition('=')
+            if not sep:
+                raise ValueError(f"option {option!r} should be Name=value")
+            spec.options[name] = value
+        if not (spec.path / 'chest' / 'uci.py').exists():
+            raise ValueError(f"{spec.path} has no chest/uci.py")
+        return spec
+
+    @property
+    def name(self) -> str:
+        options = ','.join(f"{name}={value}" for name, value in self.options.items())
+        return self.path.resolve().name + (f":{options}" if options else '')
+
+
+class UciEngine:
+    def __init__(self, spec: EngineSpec):
+        self.spec = spec
+        env = dict(os.environ, PYTHONPATH=str(spec.path.resolve()))
+        self.process = subprocess.Popen([sys.executable, '-m', 'chest.uci'], cwd=spec.path, env=env, text=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=1)
+        self.send('uci')
+        self.wait_for('uciok')
+        for name, value in spec.options.items():
+            self.send(f"setoption name {name} value {value}")
+        self.ready()
+
+    def send(self, line: str):
+        self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+
+    def wait_for(self, prefix: str) -> str:
+        for line in self.process.stdout:
+            if line.startswith(prefix):
+                return line.strip()
+        raise RuntimeError(f"{self.spec.name} exited")
+
+    def ready(self):
+        self.send('isready')
+        self.wait_for('readyok')
+
+    def new_game(self):
+        self.send('ucinewgame')
+        self.ready()
+
+    def go(self, fen: str, black: bool, limits: str) -> Tuple[Optional[str], int, int]:
+        # (move or None, nodes, depth) for the side to move
+        self.send(f"position fen {fen} {'b' if black else 'w'}")
+        self.send(f"go {limits}")
+        nodes = depth = 0
+        for line in self.process.stdout:
+            if line.startswith('info') and ' string ' not in line:
+                match = INFO_NODES.search(line)
+                nodes = int(match.group(1)) if match else nodes
+                match = INFO_DEPTH.search(line)
+                depth = int(match.group(1)) if match else depth
+            elif line.startswith('bestmove'):
+                move = line.split()[1]
+                return (None if move == '0000' else move), nodes, depth
+        raise RuntimeError(f"{self.spec.name} exited")
+
+    def close(self):
+        if self.process.poll() is None:
+            self.send('quit')
+            self.process.wait()
+
+
+@dataclass
+class SideStats:
+    moves: int = 0
+    nodes: int = 0
+    depth: int = 0
+    seconds: float = 0.0
+
+    def add(self, other: 'SideStats'):
+        self.moves += other.moves
+        self.nodes += other.nodes
+        self.depth += other.depth
+        self.seconds += other.seconds
+
+
+@dataclass
+class GameResult:
+    # score is for the first engine: 1, 0.5 or 0
+    opening: str
+    first_white: bool
+    score: float
+    reason: str
+    plies: int
+    stats: Tuple[SideStats, SideStats]
+
+
+# Every worker starts both engines once and keeps them for all its games.
+_engines: Tuple[UciEngine, ...] = ()
+_limits = 'depth 3'
+_max_plies = MAX_PLIES
+_barrier = None
+
+
+def _init_worker(specs: Tuple[EngineSpec, EngineSpec], limits: str, max_plies: int, barrier):
+    global _engines, _limits, _max_plies, _barrier
+    _engines = tuple(UciEngine(spec) for spec in specs)
+    _limits, _max_plies, _barrier = limits, max_plies, barrier
+
+
+def _close_engines():
+    # submitted once per worker; the barrier keeps one worker from taking two
+    for engine in _engines:
+        engine.close()
+    try:
+        _barrier.wait(timeout=60)
+    except BrokenBarrierError:
+        pass
+
+
+def square(pos: Position, name: str) -> int:
+    return pos.board_width * (pos.board_height - int(name[1:])) + ord(name[0]) - 97
+
+
+def play_game(fen: str, color: Color, first_moves: bool) -> GameResult:
+    # one game from fen with color to move; first_moves says whether the
+    # first engine makes the first move
+    pos = Position.from_fen(fen)
+    black = color == Color.black
+    first_white = first_moves != black
+    stats = (SideStats(), SideStats())
+    for engine in _engines:
+        engine.new_game()
+    seen = Counter()
+    score, reason = 0.5, f"{_max_plies} plies"
+    for ply in range(_max_plies):
+        side = ply % 2 if first_moves else 1 - ply % 2
+        position = f"{pos.to_fen()} {'b' if black else 'w'}"
+        seen[position] += 1
+        if seen[position] == 3:
+            reason = 'repetition'
+            break
+        start = perf_counter()
+        name, nodes, depth = _engines[side].go(pos.to_fen(), black, _limits)
+        played = stats[side]
+        played.seconds += perf_counter() - start
+        played.moves += 1
+        played.nodes += nodes
+        played.depth += depth
+        if name is None:
+            score, reason = float(side == 1), 'no moves'
+            break
+        start_square, end_square = square(pos, name[:2]), square(pos, name[2:4])
+        piece = pos.board[start_square]
+        if not piece or piece.isupper() == black:
+            score, reason = float(side == 1), f"bad move {name}"
+            break
+        captured = pos.board[end_square]
+        pos.make_move(start_square, end_square)
+        if captured.lower() == 'k':
+            score, reason = float(side == 0), 'king taken'
+            break
+        black = not black
+    return GameResult(fen, first_white, score, reason, len(pos.history), stats)
+
+
+def random_start(fen: str, color: Color, plies: int, rng: Random) -> Tuple[str, Color]:
+    # fen after up to plies random moves, none of which gives a king away or
+    # leaves the side to move without a move
+    pos = Position.from_fen(fen)
+    black = color == Color.black
+    for _ in range(plies):
+        moves = generate_moves(pos, black)
+        rng.shuffle(moves)
+        for move in moves:
+            pos.make_move(*move)
+            king = pos.black_king if black else pos.white_king
+            if king is not None and not in_check(pos, king) and not isinf(evaluate(pos, not black)) \
+                    and generate_moves(pos, not black):
+                break
+            pos.unmake_move()
+        else:
+            break
+        black = not black
+    return pos.to_fen(), Color.black if black else Color.white
+
+
+def schedule(openings: List[Tuple[str, Color]], games: int, plies: int, rng: Random,
+             unique: bool) -> List[Tuple[str, Color, bool]]:
+    # (fen, color, first engine moves first) for up to games games: every
+    # start is played twice, once with each engine moving first; the
+    # openings as given come first, then random starts from them. Unique
+    # schedules stop early once a round over the openings finds nothing new.
+    scheduled, seen = [], set()
+    for round in count():
+        added = False
+        for fen, color in openings:
+            start = random_start(fen, color, plies, rng) if round else (fen, color)
+            if unique and start in seen:
+                continue
+            seen.add(start)
+            added = True
+            scheduled += [(*start, True), (*start, False)]
+            if len(scheduled) >= games:
+                return scheduled[:games]
+        if not added:
+            return scheduled
+
+
+def expected_score(elo: float) -> float:
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo(score: float) -> float:
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return 400 * log10(score / (1 - score))
+
+
+def sprt(wins: int, draws: int, losses: int, elo0: float, elo1: float) -> float:
+    # log-likelihood ratio of elo1 against elo0 for the first engine, from
+    # the normal approximation to the win/draw/loss distribution
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:
+        return 0.0
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    return games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+
+
+def read_openings(lines) -> List[Tuple[str, Color]]:
+    openings = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            openings.append(parse_line(line, Color.white))
+    return openings
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.match',
+                            description='play two engines against each other and test the difference with SPRT')
+    parser.add_argument('engines', nargs='*', metavar='ENGINE',
+                        help=f"package directory, optionally followed by :Name=value,... UCI options "
+                             f"(default: {PACKAGE} for both)")
+    parser.add_argument('--openings', type=FileType('r'),
+                        help='FENs to start from, each optionally followed by w or b (default: the bench suite)')
+    parser.add_argument('--games', type=int, default=1000, help='most games to play')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--movetime', type=int, help='milliseconds per move')
+    parser.add_argument('--nodes', type=int, help='nodes per move')
+    parser.add_argument('--depth', type=int, default=3, help='depth per move, without --movetime or --nodes')
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES, help='longer games are drawn')
+    parser.add_argument('--random-plies', type=int, default=RANDOM_PLIES,
+                        help='random moves into an opening for starts after the first pass over them')
+    parser.add_argument('--seed', type=int, help='seed for the random starts')
+    parser.add_argument('--elo0', type=float, default=0.0)
+    parser.add_argument('--elo1', type=float, default=10.0)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    if len(args.engines) > 2:
+        parser.error('at most two engines')
+    try:
+        specs = tuple(EngineSpec.parse(text) for text in args.engines)
+        specs = (specs + (EngineSpec(PACKAGE),) * 2)[:2]
+        openings = read_openings(args.openings) if args.openings else [(fen, color) for fen, color in SUITE]
+    except ValueError as e:
+        parser.error(str(e))
+    limits = f"movetime {args.movetime}" if args.movetime else f"nodes {args.nodes}" if args.nodes \
+        else f"depth {args.depth}"
+    lower, upper = log(args.beta / (1 - args.alpha)), log((1 - args.beta) / args.alpha)
+
+    # only a movetime makes engines play differently from the same start
+    games = schedule(openings, args.games, args.random_plies, Random(args.seed), unique=not args.movetime)
+    if len(games) < args.games:
+        print(f"only {len(games)} distinct games: use --random-plies or --movetime for more")
+    workers = max(min(args.workers, len(games)), 1)
+    results = Counter()
+    totals = (SideStats(), SideStats())
+    llr, verdict = 0.0, None
+    print(f"{specs[0].name} vs {specs[1].name}, {limits}, {len(openings)} openings, "
+          f"SPRT elo0 {args.elo0} elo1 {args.elo1}")
+    start = perf_counter()
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                               initargs=(specs, limits, args.max_plies, Barrier(workers)))
+    futures = []
+    try:
+        futures += [pool.submit(play_game, *game) for game in games]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.score] += 1
+            for total, side in zip(totals, result.stats):
+                total.add(side)
+            wins, draws, losses = results[1.0], results[0.5], results[0.0]
+            llr = sprt(wins, draws, losses, args.elo0, args.elo1)
+            print(f"{wins + draws + losses} games: +{wins} ={draws} -{losses}, LLR {llr:.2f} "
+                  f"({lower:.2f}, {upper:.2f}); {result.reason} after {result.plies} plies")
+            if llr <= lower or llr >= upper:
+                verdict = 'H1 accepted' if llr >= upper else 'H0 accepted'
+                break
+    finally:
+        for future in futures:
+            future.cancel()
+        # quit every worker's engines rather than leave them to notice the pipes closing
+        wait([pool.submit(_close_engines) for _ in range(workers)])
+        pool.shutdown()
+    seconds = perf_counter() - start
+
+    played = sum(results.values())
+    wins, draws, losses = results[1.0], results[0.5], results[0.0]
+    print(f"{verdict or 'no verdict'} after {played} games in {seconds:.1f}s "
+          f"({3600 * played / max(seconds, 1e-9):.0f} games/hour): +{wins} ={draws} -{losses}, "
+          f"elo {elo((wins + draws / 2) / played) if played else 0.0:+.1f}")
+    for spec, total in zip(specs, totals):
+        # an engine's speed as if it played both sides of every game
+        per_hour = 3600 * played / (2 * total.seconds) if total.seconds else 0.0
+        print(f"  {spec.name}: {per_hour:.0f} games/hour, {total.nodes / max(total.seconds, 1e-9):.0f} nps, "
+              f"depth {total.depth / max(total.moves, 1):.1f}, {total.moves} moves")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
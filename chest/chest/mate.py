@@ -0,0 +1,236 @@
+import sys
+from argparse import ArgumentParser
+from math import inf
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from chest.models import Position, Color
+from chest.evaluate import evaluate, generate_moves, in_check, iterative_deepening
+from chest.search import SearchContext, SearchTimeout
+from chest.transposition import TranspositionTable
+from chest.utils import move_name
+from chest.zobrist import search_key
+
+# Depth-first proof-number search (df-pn) for forced mates. Every node has a
+# proof and a disproof number for the side to move: about how many more
+# leaves would have to be settled to show that it wins, or that it loses.
+# Instead of searching every move to the same depth, the search follows
+# whichever node would settle the root with the least work, and in a
+# forcing line that is a small part of the tree.
+#
+# Nodes are won and lost by the search's own rules: evaluate returning
+# +-inf (a king taken, or boxed in and attacked), or no moves at all. The
+# attacker also loses where the plies run out. The plies left are part of
+# a node's key, so the same position with fewer plies to go is another
+# node and a repetition can't make a cycle. The bound goes up a move at a
+# time, so the first mate found is the shortest. A node counts towards
+# ctx.nodes when it is first looked at, so a node limit also bounds the
+# table.
+INFINITE = 10 ** 9
+
+# (fen, attacker, moves): mates under the engine's rules, where knights
+# and pawns don't move
+PUZZLES = [
+    ('6k1/5ppp/8/8/8/8/8/R5K1', Color.white, 2),
+    ('3k4/8/3K4/8/8/8/8/7R', Color.white, 2),
+    ('7k/8/6K1/8/8/8/8/R7', Color.white, 2),
+    ('6k1/8/6K1/8/8/8/8/3Q4', Color.white, 2),
+    ('k7/8/8/8/8/8/5q2/7K', Color.black, 2),
+    ('7k/8/8/8/8/8/R7/1R4K1', Color.white, 3),
+    ('4k3/8/8/8/8/8/8/R3K2R', Color.white, 3),
+    ('k7/8/2K5/8/8/8/8/7Q', Color.white, 3),
+]
+
+
+class MateSearch:
+    def __init__(self, pos: Position, black: bool, ctx: SearchContext):
+        self.pos = pos
+        self.black = black
+        self.ctx = ctx
+        # (key, plies left) -> [proof, disproof, plies to the end once settled]
+        self.table: Dict[Tuple[int, int], List[int]] = {}
+
+    def key(self, black_to_move: bool, plies: int) -> Tuple[int, int]:
+        return search_key(self.pos.key, black_to_move, False), plies
+
+    def exposed(self, black: bool) -> bool:
+        king = self.pos.black_king if black else self.pos.white_king
+        return king is not None and in_check(self.pos, king)
+
+    def leaf(self, black_to_move: bool, plies: int) -> List[int]:
+        # the first entry of a node, before any of its children are searched
+        self.ctx.visit()
+        pos = self.pos
+        score = evaluate(pos, black_to_move)
+        if score == inf:
+            return [0, INFINITE, 0]
+        if score == -inf:
+            return [INFINITE, 0, 0]
+        if plies > 0 and self.exposed(not black_to_move):
+            # the king can be taken with the next move
+            return [0, INFINITE, 1]
+        if plies == 0:
+            # out of plies: the defender has held out
+            return [INFINITE, 0, 0] if black_to_move == self.black else [0, INFINITE, 0]
+        moves = generate_moves(pos, black_to_move)
+        if not moves:
+            return [INFINITE, 0, 0]
+        # a side with few moves is quicker to beat, so the disproof number
+        # starts as the number of moves that don't give the king away
+        safe = len(moves)
+        if plies > 1:
+            safe = 0
+            for move in moves:
+                pos.make_move(*move)
+                score = evaluate(pos, black_to_move)
+                safe += score == inf or score != -inf and not self.exposed(black_to_move)
+                pos.unmake_move()
+            if safe == 0:
+                return [INFINITE, 0, 2]
+        return [1, safe, 0]
+
+    def mid(self, black_to_move: bool, plies: int, proof_limit: int, disproof_limit: int) -> List[int]:
+        # expand the node until one of its numbers reaches its limit
+        pos, table = self.pos, self.table
+        key = self.key(black_to_move, plies)
+        children = []
+        for move in generate_moves(pos, black_to_move):
+            pos.make_move(*move)
+            child = self.key(not black_to_move, plies - 1)
+            if child not in table:
+                table[child] = self.leaf(not black_to_move, plies - 1)
+            pos.unmake_move()
+            children.append((move, child))
+        if not children:
+            table[key] = [INFINITE, 0, 0]
+            return table[key]
+
+        while True:
+            # this node wins if any child loses, and loses if every child wins
+            proof = min(table[child][1] for _, child in children)
+            disproof = min(sum(table[child][0] for _, child in children), INFINITE)
+            if proof >= proof_limit or disproof >= disproof_limit:
+                break
+            best = second = None
+            for move, child in children:
+                if best is None or table[child][1] < table[best[1]][1]:
+                    best, second = (move, child), best
+                elif second is None or table[child][1] < table[second[1]][1]:
+                    second = move, child
+            move, child = best
+            pos.make_move(*move)
+            self.mid(not black_to_move, plies - 1,
+                     min(disproof_limit - disproof + table[child][0], INFINITE),
+                     min(proof_limit, table[second[1]][1] + 1 if second else INFINITE))
+            pos.unmake_move()
+
+        if proof == 0:
+            distance = 1 + min(table[child][2] for _, child in children if table[child][1] == 0)
+        elif disproof == 0:
+            distance = 1 + max(table[child][2] for _, child in children)
+        else:
+            distance = 0
+        table[key] = [proof, disproof, distance]
+        return table[key]
+
+    def line(self, black_to_move: bool, plies: int) -> List[Tuple[int, int]]:
+        # from a won node: the quickest win against the longest defence
+        pos, table = self.pos, self.table
+        root_ply = len(pos.history)
+        line = []
+        while True:
+            entry = table.get(self.key(black_to_move, plies)) or self.leaf(black_to_move, plies)
+            if entry[2] == 0:
+                break
+            attacker = black_to_move == self.black
+            moves = generate_moves(pos, black_to_move)
+            best = next((move for move in moves if attacker and pos.board[move[1]].lower() == 'k'), None)
+            if best is not None:
+                line.append(best)
+                break
+            best_distance = None
+            for move in moves:
+                pos.make_move(*move)
+                entry = table.get(self.key(not black_to_move, plies - 1))
+                pos.unmake_move()
+                if entry is None or (entry[1] if attacker else entry[0]) != 0:
+                    continue
+                if best is None or (entry[2] < best_distance if attacker else entry[2] > best_distance):
+                    best, best_distance = move, entry[2]
+            if best is None:
+                # settled before its moves were searched: every one of them loses
+                best = moves[0]
+            pos.make_move(*best)
+            line.append(best)
+            black_to_move, plies = not black_to_move, plies - 1
+        while len(pos.history) > root_ply:
+            pos.unmake_move()
+        return line
+
+
+def find_mate(pos: Position, turn: Color, max_moves: int = 5, ctx: Optional[SearchContext] = None,
+              time_limit: Optional[float] = None,
+              node_limit: Optional[int] = None) -> Optional[Tuple[int, List[Tuple[int, int]]]]:
+    # (moves, line) for turn's quickest mate in at most max_moves, or None
+    # if there isn't one or the budget ran out first
+    if ctx is None:
+        ctx = SearchContext()
+    ctx.set_budget(time_limit, node_limit)
+    black = turn == Color.black
+    search = MateSearch(pos, black, ctx)
+    root_ply = len(pos.history)
+    score = evaluate(pos, black)
+    if score in (inf, -inf):
+        # already over
+        return (0, []) if score == inf else None
+    found = None
+    try:
+        for moves in range(1, max_moves + 1):
+            proof, _, _ = search.mid(black, 2 * moves - 1, INFINITE, INFINITE)
+            if proof == 0:
+                found = moves
+                break
+    except SearchTimeout:
+        while len(pos.history) > root_ply:
+            pos.unmake_move()
+    ctx.deadline = ctx.node_limit = None
+    if found is None:
+        return None
+    return found, search.line(black, 2 * found - 1)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.mate',
+                            description='look for a forced mate with proof-number search')
+    parser.add_argument('fen', nargs='?', help='position to solve (default: the puzzle suite)')
+    parser.add_argument('--color', choices=[c.value for c in Color], default=Color.white.value)
+    parser.add_argument('--moves', type=int, default=5, help='longest mate to look for')
+    parser.add_argument('--nodes', type=int, help='give up after this many nodes')
+    parser.add_argument('--compare', action='store_true',
+                        help='also search each position with alpha-beta to the mate\'s depth')
+    args = parser.parse_args(argv)
+
+    puzzles = [(args.fen, Color(args.color), args.moves)] if args.fen else PUZZLES
+    total = total_alpha_beta = 0
+    for fen, color, moves in puzzles:
+        pos = Position.from_fen(fen)
+        ctx = SearchContext()
+        start = perf_counter()
+        found = find_mate(pos, color, moves, ctx, node_limit=args.nodes)
+        seconds = perf_counter() - start
+        total += ctx.nodes
+        result = f"mate in {found[0]}: {' '.join(move_name(pos, m) for m in found[1])}" if found else 'no mate found'
+        print(f"{fen} {color.value}: {result} ({ctx.nodes} nodes, {seconds:.2f}s)")
+        if args.compare and found:
+            ab = SearchContext(tt=TranspositionTable())
+            start = perf_counter()
+            _, score, _ = iterative_deepening(pos, color, 2 * found[0] - 1, ctx=ab)
+            total_alpha_beta += ab.nodes
+            print(f"  alpha-beta: score {score} ({ab.nodes} nodes, {perf_counter() - start:.2f}s)")
+    if args.compare:
+        print(f"proof-number search: {total} nodes, alpha-beta: {total_alpha_beta} nodes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,10 @@
 from enum import Enum
-from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Optional
 from string import digits
 
+from chest.zobrist import ZOBRIST, board_key, geometry_key
+
 
 
 class Piece(str, Enum):
@@ -33,13 +35,34 @@ class Position:
     board: List[int]
     white_pieces: List[Tuple[Piece, int]]
     black_pieces: List[Tuple[Piece, int]]
+    # kept up to date by make_move/unmake_move instead of being rescanned
+    material: Optional[int] = field(default=None, compare=False)
+    white_king: Optional[int] = field(default=None, compare=False)
+    black_king: Optional[int] = field(default=None, compare=False)
+    key: Optional[int] = field(default=None, compare=False, repr=False)
+    history: List[Tuple[int, int, str, int, Optional[int]]] = field(default_factory=list, compare=False, repr=False)
+
+    def __post_init__(self):
+        if self.material is None:
+            self.material = sum(piece_values[Piece(p)] for p, _ in self.white_pieces) \
+                - sum(piece_values[Piece(p)] for p, _ in self.black_pieces)
+            self.white_king = next((idx for p, idx in self.white_pieces if p == Piece.king), None)
+            self.black_king = next((idx for p, idx in self.black_pieces if p == Piece.king), None)
+        if self.key is None:
+            self.key = board_key(self.board) ^ geometry_key(self.board_width, self.board_height)
 
     def __hash__(self):
-        return hash(str(self.board))
+        return self.key
+
+    def to_array(self):
+        from chest.vector import board_array
+        return board_array(self)
 
     @classmethod
     def from_fen(self, fen: str):
-        position = Position(8, 8, ['' for _ in range(8*8)], [], [])
+        board = ['' for _ in range(8*8)]
+        white_pieces = []
+        black_pieces = []
         rows = fen.split('/')
         row_idx = 0
         for row in rows:
@@ -48,14 +71,14 @@ class Position:
                 if c in digits:
                     column += int(c) - 1
                 else:
-                    position.board[position.board_width * row_idx + column] = c
+                    board[8 * row_idx + column] = c
                     if c.isupper():
-                        position.white_pieces.append((c.lower(), position.board_width * row_idx + column))
+                        white_pieces.append((c.lower(), 8 * row_idx + column))
                     else:
-                        position.black_pieces.append((c, position.board_width * row_idx + column))
+                        black_pieces.append((c, 8 * row_idx + column))
                 column += 1
             row_idx += 1
-        return position
+        return Position(8, 8, board, white_pieces, black_pieces)
         
     def to_fen(self):
         output = ''
@@ -78,32 +101,83 @@ class Position:
         return output
 
     def perform_move(self, start: int, end: int):
-        color = color_of_piece(self.board[start])
+        position = Position(self.board_height, self.board_width, self.board.copy(),
+                            self.white_pieces.copy(), self.black_pieces.copy(),
+                            self.material, self.white_king, self.black_king, self.key)
+        position.make_move(start, end)
+        return position
+
+    def make_move(self, start: int, end: int):
         piece = self.board[start]
-        captured_piece = None
-
-        new_white_pieces = self.white_pieces.copy()
-        new_black_pieces = self.black_pieces.copy()
-        new_board = self.board.copy()
-
-        new_board[start] = ''
-        if new_board[end] != '':
-            captured_piece = new_board[end]
-        new_board[end] = piece
-    
-        if color == Color.black:
-            new_black_pieces.append((piece, end))
-            new_black_pieces.remove((piece, start))
-
-            if captured_piece:
-                new_white_pieces.remove((captured_piece.lower(), end))
+        captured = self.board[end]
+        if color_of_piece(piece) == Color.white:
+            own, other = self.white_pieces, self.black_pieces
+        else:
+            own, other = self.black_pieces, self.white_pieces
+
+        slot = own.index((piece.lower(), start))
+        own[slot] = (piece.lower(), end)
+        if piece.lower() == Piece.king:
+            self._set_king(piece, end)
+
+        captured_slot = None
+        if captured:
+            # swap-remove; unmake_move puts the last piece back where it was
+            captured_slot = other.index((captured.lower(), end))
+            last = other.pop()
+            if captured_slot < len(other):
+                other[captured_slot] = last
+            self.material -= self._material_sign(captured) * piece_values[Piece(captured.lower())]
+            if captured.lower() == Piece.king:
+                self._set_king(captured, None)
+
+        self.key ^= ZOBRIST[piece][start] ^ ZOBRIST[piece][end]
+        if captured:
+            self.key ^= ZOBRIST[captured][end]
+
+        self.board[end] = piece
+        self.board[start] = ''
+        self.history.append((start, end, captured, slot, captured_slot))
+
+    def unmake_move(self):
+        start, end, captured, slot, captured_slot = self.history.pop()
+        piece = self.board[end]
+        if color_of_piece(piece) == Color.white:
+            own, other = self.white_pieces, self.black_pieces
+        else:
+            own, other = self.black_pieces, self.white_pieces
+
+        own[slot] = (piece.lower(), start)
+        if piece.lower() == Piece.king:
+            self._set_king(piece, start)
+
+        if captured:
+            entry = (captured.lower(), end)
+            if captured_slot == len(other):
+                other.append(entry)
+            else:
+                other.append(other[captured_slot])
+                other[captured_slot] = entry
+            self.material += self._material_sign(captured) * piece_values[Piece(captured.lower())]
+            if captured.lower() == Piece.king:
+                self._set_king(captured, end)
+
+        self.key ^= ZOBRIST[piece][start] ^ ZOBRIST[piece][end]
+        if captured:
+            self.key ^= ZOBRIST[captured][end]
+
+        self.board[start] = piece
+        self.board[end] = captured
+
+    def _set_king(self, piece: str, index: Optional[int]):
+        if piece.isupper():
+            self.white_king = index
         else:
-            new_white_pieces.append((piece.lower(), end))
-            new_white_pieces.remove((piece.lower(), start))
-            if captured_piece:
-                new_black_pieces.remove((captured_piece.lower(), end))
+            self.black_king = index
 
-        return Position(self.board_height, self.board_width, new_board, new_white_pieces, new_black_pieces)
+    @staticmethod
+    def _material_sign(piece: str) -> int:
+        return 1 if piece.isupper() else -1
 
 def color_of_piece(piece: str) -> Color:
     return Color.white if piece.isupper() else Color.black
\ No newline at end of file
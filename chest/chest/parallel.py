@@ -0,0 +1,126 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from math import inf
+from multiprocessing import Value
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from chest.models import Position
+from chest.evaluate import alpha_beta, evaluate, generate_moves
+from chest.ordering import order_moves
+from chest.search import SearchContext, SearchStats, SearchTimeout
+from chest.tablebase import Tablebase
+from chest.transposition import TranspositionTable, EXACT, LOWER, UPPER, DEFAULT_SIZE_MB
+from chest.zobrist import search_key
+
+# Scores are small integers (or +-inf), so searching every root move with a
+# window just below the best score found so far still returns exact scores
+# for anything that could tie or beat it. Mates are clamped to MATE_BOUND so
+# that a second mating move isn't cut off before it is recognised as one.
+MATE_BOUND = 1_000_000
+
+_alpha = None
+# nodes left of the current root's budget, claimed by the workers as they search
+_budget = None
+_ctx: Optional[SearchContext] = None
+
+# the caller's search settings, applied to a worker's context for each task
+SETTINGS = ('ordering', 'batch_leaves', 'quiescence', 'null_move', 'reductions', 'aspiration')
+
+
+def _init_worker(alpha, budget, tt_mb: float, tablebase: Optional[Path]):
+    global _alpha, _budget, _ctx
+    _alpha, _budget = alpha, budget
+    # the tables are memory-mapped, so each worker opens the file itself
+    _ctx = SearchContext(tt=TranspositionTable(tt_mb), tablebase=Tablebase(tablebase) if tablebase else None)
+
+
+def _search_move(fen: str, black: bool, move: Tuple[int, int], max_depth: int, beta: float,
+                 pv: List[Tuple[int, int]], deadline: Optional[float], limited: bool,
+                 settings: Dict[str, bool], stats: bool):
+    ctx = _ctx
+    for name, value in settings.items():
+        setattr(ctx, name, value)
+    # counted afresh for each move and sent back to be merged into the caller's
+    ctx.counter = Counter()
+    ctx.stats = SearchStats() if stats else None
+    ctx.pv = pv
+    ctx.deadline = deadline
+    nodes = ctx.nodes
+    if limited:
+        ctx.shared_budget, ctx.node_limit = _budget, nodes
+    pos = Position.from_fen(fen)
+    pos.make_move(*move)
+    bound = min(_alpha.value, MATE_BOUND) - 1
+    try:
+        _, score = alpha_beta(pos, ctx, black, max_depth, 1, bound, beta, False)
+    except SearchTimeout:
+        return None
+    finally:
+        ctx.deadline = None
+        if limited:
+            ctx.release_nodes()
+    with _alpha.get_lock():
+        if score > _alpha.value:
+            _alpha.value = score
+    return score, ctx.nodes - nodes, ctx.counter, ctx.stats
+
+
+class RootSplitter:
+    def __init__(self, workers: int, tt_mb: float = DEFAULT_SIZE_MB, tablebase: Optional[Path] = None):
+        self.alpha = Value('d', -inf)
+        self.budget = Value('q', 0)
+        self.pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                        initargs=(self.alpha, self.budget, tt_mb / workers, tablebase))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def search(self, pos: Position, ctx: SearchContext, black: bool, max_depth: int,
+               alpha: float = -inf, beta: float = inf):
+        # same contract as alpha_beta at the root: (best move, score)
+        board = evaluate(pos, black)
+        if board == inf or board == -inf:
+            return None, board
+
+        key = search_key(pos.key, black, black)
+        entry = ctx.tt.probe(key) if ctx.tt is not None else None
+        moves = order_moves(pos, generate_moves(pos, black), ctx, 0, entry[3] if entry is not None else None)
+
+        self.alpha.value = alpha
+        self.budget.value = max(ctx.node_limit - ctx.nodes, 0) if ctx.node_limit is not None else 0
+        fen = pos.to_fen()
+        settings = {name: getattr(ctx, name) for name in SETTINGS}
+        futures = [self.pool.submit(_search_move, fen, black, move, max_depth, beta, ctx.pv, ctx.deadline,
+                                    ctx.node_limit is not None, settings, ctx.stats is not None)
+                   for move in moves]
+
+        best_move, value = (0, 0), -inf
+        try:
+            for move, future in zip(moves, futures):
+                result = future.result()
+                if result is None:
+                    raise SearchTimeout()
+                score, nodes, counter, stats = result
+                ctx.nodes += nodes
+                ctx.merge(counter, stats)
+                if ctx.node_limit is not None and ctx.nodes > ctx.node_limit:
+                    raise SearchTimeout()
+                # first move in root order wins ties, as in the serial search
+                if score > value:
+                    best_move, value = move, score
+        except SearchTimeout:
+            for future in futures:
+                future.cancel()
+            raise
+
+        if ctx.tt is not None and best_move != (0, 0):
+            flag = UPPER if value <= alpha else LOWER if value >= beta else EXACT
+            ctx.tt.store(key, max_depth, flag, value, best_move)
+        return best_move, value
@@ -0,0 +1,85 @@
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+from chest.models import Position, Color
+from chest.evaluate import generate_moves
+from chest.utils import move_name
+
+SUITE = Path(__file__).with_name('perft_suite.json')
+
+
+def perft(pos: Position, black: bool, depth: int) -> int:
+    if depth == 0:
+        return 1
+    nodes = 0
+    for start, end in generate_moves(pos, black):
+        pos.make_move(start, end)
+        nodes += perft(pos, not black, depth - 1)
+        pos.unmake_move()
+    return nodes
+
+
+def divide(pos: Position, black: bool, depth: int):
+    for start, end in generate_moves(pos, black):
+        pos.make_move(start, end)
+        nodes = perft(pos, not black, depth - 1)
+        pos.unmake_move()
+        yield (start, end), nodes
+
+
+def report(nodes: int, seconds: float) -> str:
+    return f"{nodes} nodes in {seconds:.3f}s ({nodes / max(seconds, 1e-9):.0f} nps)"
+
+
+def run_suite(record: bool = False) -> bool:
+    suite = json.loads(SUITE.read_text())
+    ok = True
+    for case in suite:
+        now = perf_counter()
+        nodes = perft(Position.from_fen(case['fen']), case['color'] == Color.black, case['depth'])
+        seconds = perf_counter() - now
+        status = 'ok' if nodes == case['nodes'] else f"FAIL (expected {case['nodes']})"
+        ok &= nodes == case['nodes']
+        print(f"{case['fen']} {case['color']} depth {case['depth']}: {report(nodes, seconds)}"
+              f" [reference {case['seconds']:.3f}s] {status}")
+        if record:
+            case.update(nodes=nodes, seconds=round(seconds, 3))
+    if record:
+        SUITE.write_text(json.dumps(suite, indent=2) + '\n')
+    return ok
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.perft', description='count leaf nodes of calculate_moves to a fixed depth')
+    parser.add_argument('fen', nargs='?')
+    parser.add_argument('depth', nargs='?', type=int, default=3)
+    parser.add_argument('--color', choices=[c.value for c in Color], default=Color.white.value)
+    parser.add_argument('--divide', action='store_true', help='print the node count below each root move')
+    parser.add_argument('--suite', action='store_true', help=f'run the reference positions in {SUITE.name}')
+    parser.add_argument('--record', action='store_true', help='with --suite, store the measured counts and timings')
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.record) else 1
+    if args.fen is None:
+        parser.error('a FEN is required unless --suite is given')
+
+    pos = Position.from_fen(args.fen)
+    black = args.color == Color.black
+    now = perf_counter()
+    if args.divide:
+        nodes = 0
+        for move, count in divide(pos, black, args.depth):
+            print(f"{move_name(pos, move)}: {count}")
+            nodes += count
+    else:
+        nodes = perft(pos, black, args.depth)
+    print(report(nodes, perf_counter() - now))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
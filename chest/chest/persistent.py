@@ -0,0 +1,170 @@
+import mmap
+import os
+import struct
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Optional, Tuple
+
+from chest.transposition import TranspositionTable, ENTRY_BYTES, DEFAULT_SIZE_MB, encode_move, decode_move
+from chest.zobrist import BLACK_TO_MOVE
+
+MAGIC = b'CHTT'
+VERSION = 1
+# magic, version, generation, entries, and a zobrist key so that a file
+# written with other keys isn't trusted
+HEADER = struct.Struct('<4sHHQQ')
+HEADER_BYTES = 64
+
+DEFAULT_PATH = Path(__file__).with_name('search_cache.bin')
+
+# a score and its bits, which are folded into each entry's check
+DOUBLE = struct.Struct('d')
+BITS = struct.Struct('Q')
+
+
+def _check(bits: int, move: int, depth: int, flag: int) -> int:
+    return bits ^ (move | depth << 16 | flag << 24)
+
+
+class PersistentTable(TranspositionTable):
+    # A transposition table kept in a memory-mapped file, so that what one
+    # run learns is there for the next, and worker processes that open the
+    # same file share it. Keys are zobrist keys, which are the same in every
+    # process. Nothing is locked: each entry's key is stored xor'd with its
+    # contents, so an entry torn by two processes writing at once just fails
+    # to match and reads as a miss.
+    def __init__(self, path: Path = DEFAULT_PATH, size_mb: float = DEFAULT_SIZE_MB):
+        self.path = Path(path)
+        self.size_mb = size_mb
+        size = max(1, int(size_mb * 2**20) // ENTRY_BYTES)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if os.fstat(fd).st_size == 0:
+                # a new file; an existing one keeps the size it was made with
+                os.ftruncate(fd, HEADER_BYTES + ENTRY_BYTES * size)
+                os.pwrite(fd, HEADER.pack(MAGIC, VERSION, 0, size, BLACK_TO_MOVE), 0)
+            header = os.pread(fd, HEADER.size, 0)
+            magic, version, generation, size, zobrist = HEADER.unpack(header.ljust(HEADER.size, b'\0'))
+            if magic != MAGIC or version != VERSION or zobrist != BLACK_TO_MOVE \
+                    or os.fstat(fd).st_size != HEADER_BYTES + ENTRY_BYTES * size:
+                raise ValueError(f"{self.path} is not a version {VERSION} search cache")
+            self.mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.generation = generation
+        view = memoryview(self.mm)
+        offset = HEADER_BYTES
+
+        def region(typecode: str, itemsize: int):
+            nonlocal offset
+            start, offset = offset, offset + itemsize * size
+            return view[start:offset].cast(typecode)
+
+        self.keys = region('Q', 8)
+        self.scores = region('d', 8)
+        self.moves = region('H', 2)
+        self.depths = region('B', 1)
+        self.flags = region('B', 1)
+        self.generations = region('B', 1)
+        # the same bytes as scores, to fold them into the check
+        self.score_bits = self.scores.cast('B').cast('Q')
+        self.view = view
+
+    def close(self):
+        if self.mm.closed:
+            return
+        for table in (self.keys, self.scores, self.score_bits, self.moves, self.depths, self.flags,
+                      self.generations, self.view):
+            table.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        # worker processes map the file again rather than copying it
+        return self.path, self.size_mb
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def flush(self):
+        self.mm.flush()
+
+    def new_search(self):
+        super().new_search()
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.generation, self.size, BLACK_TO_MOVE)
+
+    def clear(self):
+        self.view[HEADER_BYTES:] = bytes(len(self.view) - HEADER_BYTES)
+
+    def _read(self, slot: int):
+        # each field is read once, so the entry that is checked is the one
+        # returned even if another process rewrites the slot meanwhile
+        bits, move, depth, flag = self.score_bits[slot], self.moves[slot], self.depths[slot], self.flags[slot]
+        if flag == 0:
+            return None
+        return self.keys[slot] ^ _check(bits, move, depth, flag), bits, move, depth, flag
+
+    def probe(self, key: int):
+        slot = key % self.size
+        entry = self._read(slot)
+        if entry is None or entry[0] != key:
+            return None
+        _, bits, move, depth, flag = entry
+        # Entries that are still being used survive into later runs. The
+        # generation isn't part of the check, so writing it can't tear an
+        # entry; at worst it marks another process's new entry as current.
+        self.generations[slot] = self.generation
+        return depth, flag, DOUBLE.unpack(BITS.pack(bits))[0], decode_move(move)
+
+    def store(self, key: int, depth: int, flag: int, score: float, move: Optional[Tuple[int, int]]):
+        slot = key % self.size
+        entry = self._read(slot)
+        same = entry is not None and entry[0] == key
+        if entry is not None and not same \
+                and self.generations[slot] == self.generation and entry[3] > depth:
+            return
+        if same and move is None:
+            move = decode_move(entry[2])
+        bits = BITS.unpack(DOUBLE.pack(score))[0]
+        move, depth = encode_move(move), min(depth, 255)
+        self.scores[slot] = score
+        self.moves[slot] = move
+        self.depths[slot] = depth
+        self.flags[slot] = flag
+        self.generations[slot] = self.generation
+        self.keys[slot] = key ^ _check(bits, move, depth, flag)
+
+    def used(self) -> int:
+        return self.size - self.flags.tobytes().count(0)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.persistent',
+                            description='create, inspect or clear an on-disk search cache')
+    parser.add_argument('path', nargs='?', type=Path, default=DEFAULT_PATH)
+    parser.add_argument('--hash', type=float, default=DEFAULT_SIZE_MB, help='megabytes, for a new file')
+    parser.add_argument('--clear', action='store_true', help='forget every entry')
+    args = parser.parse_args(argv)
+
+    try:
+        table = PersistentTable(args.path, args.hash)
+    except ValueError as e:
+        parser.error(str(e))
+    with table:
+        if args.clear:
+            table.clear()
+        used = table.used()
+        print(f"{args.path}: {used} of {table.size} entries used ({used / table.size:.1%}), "
+              f"generation {table.generation}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chest.transposition import TranspositionTable
+from chest.tablebase import Tablebase
+
+
+# nodes a search takes from a shared budget at a time
+NODE_SLICE = 1024
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+@dataclass
+class IterationInfo:
+    depth: int
+    score: float
+    move: Optional[Tuple[int, int]]
+    pv: List[Tuple[int, int]]
+    nodes: int
+    seconds: float
+
+    @property
+    def nps(self) -> float:
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+
+class _Phase:
+    __slots__ = ('phases', 'name', 'start')
+
+    def __init__(self, phases: Counter, name: str):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        self.phases[self.name] += perf_counter() - self.start
+
+
+_NO_PHASE = nullcontext()
+
+
+@dataclass
+class SearchStats:
+    # on_progress is called with these stats every `interval` nodes
+    on_progress: Optional[Callable[['SearchStats'], None]] = None
+    interval: int = 10_000
+    nodes: int = 0
+    depth: int = 0
+    seconds: float = 0.0
+    tt_probes: int = 0
+    tt_hits: int = 0
+    # copy of SearchContext.counter: cutoffs, first_move_cutoffs, tt_cutoffs, ...
+    counters: Counter = field(default_factory=Counter)
+    # seconds spent in each phase of the search (movegen, ordering, evaluate)
+    phases: Counter = field(default_factory=Counter)
+    # hits and misses of the position caches during the search
+    caches: Dict[str, tuple] = field(default_factory=dict)
+
+    @property
+    def tt_hit_rate(self) -> float:
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    @property
+    def nps(self) -> float:
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    def cache_hit_rates(self) -> Dict[str, float]:
+        return {name: info.hits / (info.hits + info.misses) if info.hits + info.misses else 0.0
+                for name, info in self.caches.items()}
+
+    def as_dict(self) -> dict:
+        return {
+            'nodes': self.nodes,
+            'depth': self.depth,
+            'seconds': self.seconds,
+            'nps': self.nps,
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_hit_rate': self.tt_hit_rate,
+            'counters': dict(self.counters),
+            'phases': dict(self.phases),
+            'caches': {name: info._asdict() for name, info in self.caches.items()},
+            'cache_hit_rates': self.cache_hit_rates(),
+        }
+
+
+@dataclass
+class SearchContext:
+    tt: Optional[TranspositionTable] = None
+    counter: Counter = field(default_factory=Counter)
+    nodes: int = 0
+    deadline: Optional[float] = None
+    node_limit: Optional[int] = None
+    # principal variation of the last finished iteration, searched first
+    pv: List[Tuple[int, int]] = field(default_factory=list)
+    # move ordering; switch off to search moves in generation order
+    ordering: bool = True
+    killers: Dict[int, List[Tuple[int, int]]] = field(default_factory=dict)
+    history: Counter = field(default_factory=Counter)
+    # score the children of nodes just above the horizon as one numpy batch
+    batch_leaves: bool = False
+    # play out captures past the horizon instead of trusting the static evaluation
+    quiescence: bool = True
+    # selective search, off by default: null-move pruning, late-move
+    # reductions and aspiration windows around the previous iteration's score
+    null_move: bool = False
+    reductions: bool = False
+    aspiration: bool = False
+    # endgame tables, probed instead of searching positions they cover
+    tablebase: Optional[Tablebase] = None
+    # instrumentation, off unless a SearchStats is attached
+    stats: Optional[SearchStats] = None
+    # set from another thread to end the search as if the deadline had
+    # passed; like the deadline, it only applies once there is a deadline
+    stopped: bool = False
+    # nodes left of a budget shared with other processes (a multiprocessing
+    # Value); node_limit is raised from it a slice at a time once reached
+    shared_budget: Optional[Any] = None
+
+    def visit(self):
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit and not self.claim_nodes():
+            raise SearchTimeout()
+        if self.deadline is not None and self.nodes % 1024 == 0 and (self.stopped or monotonic() > self.deadline):
+            raise SearchTimeout()
+        if self.stats is not None and self.nodes % self.stats.interval == 0:
+            self.report()
+
+    def claim_nodes(self) -> bool:
+        budget = self.shared_budget
+        if budget is None:
+            return False
+        with budget.get_lock():
+            claimed = min(budget.value, NODE_SLICE)
+            budget.value -= claimed
+        self.node_limit += claimed
+        return claimed > 0
+
+    def release_nodes(self):
+        # give back what was claimed but not searched
+        with self.shared_budget.get_lock():
+            self.shared_budget.value += max(self.node_limit - self.nodes, 0)
+        self.node_limit = self.shared_budget = None
+
+    def report(self):
+        stats = self.stats
+        stats.nodes = self.nodes
+        stats.counters = self.counter.copy()
+        if stats.on_progress is not None:
+            stats.on_progress(stats)
+
+    def merge(self, counter: Counter, stats: Optional[SearchStats]):
+        # counts from part of the search done elsewhere, e.g. in a worker process
+        self.counter.update(counter)
+        if self.stats is not None and stats is not None:
+            self.stats.tt_probes += stats.tt_probes
+            self.stats.tt_hits += stats.tt_hits
+            self.stats.phases.update(stats.phases)
+            self.report()
+
+    def phase(self, name: str):
+        return _NO_PHASE if self.stats is None else _Phase(self.stats.phases, name)
+
+    def probed(self, hit: bool):
+        self.stats.tt_probes += 1
+        self.stats.tt_hits += hit
+
+    def set_budget(self, time_limit: Optional[float] = None, node_limit: Optional[int] = None):
+        self.deadline = monotonic() + time_limit if time_limit is not None else None
+        self.node_limit = self.nodes + node_limit if node_limit is not None else None
+
+    def pv_move(self, ply: int) -> Optional[Tuple[int, int]]:
+        return self.pv[ply] if ply < len(self.pv) else None
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from chest.models import Color
+from chest.batch import COLORS, _init_worker, analyse, parse_line
+from chest.persistent import PersistentTable
+from chest.transposition import DEFAULT_SIZE_MB
+
+# A long-running analysis service, so that tools calling the engine don't
+# pay for starting Python and warming its tables every time. Searches run
+# in a pool of worker processes that keep their search contexts between
+# requests, as in chest.batch. A request for a position and limits that is
+# already being searched waits for that search rather than starting
+# another, and finished results are kept for repeat queries.
+#
+#   GET /analyse?fen=<board>[+w|+b]&color=white&depth=5&time=<seconds>&nodes=<n>
+#   GET /stats
+#
+# Responses are the JSON objects chest.batch writes, or {"error": ...}.
+CACHE_SIZE = 10_000
+PORT = 8765
+START = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR'
+
+Limits = Tuple[int, Optional[float], Optional[int]]
+
+
+class AnalysisServer:
+    def __init__(self, pool: ProcessPoolExecutor, max_depth: int, cache_size: int = CACHE_SIZE):
+        self.pool = pool
+        self.max_depth = max_depth
+        self.cache_size = cache_size
+        # (fen, color, limits) -> result, least recently used first
+        self.results: OrderedDict = OrderedDict()
+        # (fen, color, limits) -> the search under way for it
+        self.searching: Dict[tuple, asyncio.Future] = {}
+        self.counts = Counter()
+
+    async def analyse(self, line: str, color: Color, limits: Limits) -> dict:
+        fen, color = parse_line(line, color)
+        key = fen, color, limits
+        self.counts['requests'] += 1
+        result = self.results.get(key)
+        if result is not None:
+            self.counts['cache_hits'] += 1
+            self.results.move_to_end(key)
+            return result
+        search = self.searching.get(key)
+        if search is None:
+            self.counts['searches'] += 1
+            search = asyncio.get_running_loop().run_in_executor(self.pool, analyse, fen, color, limits)
+            search.add_done_callback(lambda future: self.finished(key, future))
+            self.searching[key] = search
+        else:
+            self.counts['coalesced'] += 1
+        # a client that goes away doesn't cancel the search for the others
+        return await asyncio.shield(search)
+
+    def finished(self, key: tuple, search: asyncio.Future):
+        del self.searching[key]
+        if search.cancelled() or search.exception() is not None or 'error' in search.result():
+            return
+        self.results[key] = search.result()
+        if len(self.results) > self.cache_size:
+            self.results.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {**self.counts, 'cached': len(self.results), 'searching': len(self.searching)}
+
+    async def respond(self, request: str) -> Tuple[str, dict]:
+        fields = request.split()
+        if len(fields) < 2 or fields[0] != 'GET':
+            return '405 Method Not Allowed', {'error': 'only GET is supported'}
+        url = urlsplit(fields[1])
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == '/stats':
+            return '200 OK', self.stats()
+        if url.path != '/analyse':
+            return '404 Not Found', {'error': f"no such path {url.path!r}"}
+        if 'fen' not in query:
+            return '400 Bad Request', {'error': 'fen is required'}
+        color = COLORS.get(query.get('color', 'white').lower())
+        if color is None:
+            return '400 Bad Request', {'error': f"unknown color {query['color']!r}"}
+        try:
+            limits = (int(query.get('depth', self.max_depth)),
+                      float(query['time']) if 'time' in query else None,
+                      int(query['nodes']) if 'nodes' in query else None)
+            return '200 OK', await self.analyse(query['fen'], color, limits)
+        except ValueError as e:
+            return '400 Bad Request', {'error': str(e)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = (await reader.readline()).decode('latin-1')
+            # the headers say nothing we need
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            status, body = await self.respond(request)
+            payload = json.dumps(body).encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server: AnalysisServer, workers: int, host: str, port: int, unix: Optional[Path] = None):
+    # start every worker up front so that the first requests don't wait for them
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(server.pool, analyse, START, Color.white, (1, None, None))
+                           for _ in range(workers)))
+    if unix:
+        listener = await asyncio.start_unix_server(server.handle, path=unix)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    print(f"serving on {unix or f'http://{host}:{port}'} with {workers} workers", file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.server',
+                            description='serve analyses over HTTP from worker processes that stay warm')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--unix', type=Path, help='listen on this Unix socket instead of a port')
+    parser.add_argument('--depth', type=int, default=5, help='depth when a request does not say')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--hash', type=float, default=DEFAULT_SIZE_MB,
+                        help='transposition table megabytes, shared out between workers')
+    parser.add_argument('--tablebase', type=Path, help='endgame tables built by python -m chest.tablebase')
+    parser.add_argument('--cache', type=Path,
+                        help='file to keep the transposition table in between runs (created if missing)')
+    parser.add_argument('--results', type=int, default=CACHE_SIZE, help='most results to keep for repeat queries')
+    args = parser.parse_args(argv)
+
+    tt_mb = args.hash
+    if args.cache:
+        # as in chest.batch, the workers share the file and its whole size
+        PersistentTable(args.cache, tt_mb).close()
+    else:
+        tt_mb /= args.workers
+    pool = ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                               initargs=(tt_mb, args.depth, None, None, args.tablebase, args.cache))
+    try:
+        asyncio.run(serve(AnalysisServer(pool, args.depth, args.results), args.workers,
+                          args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,400 @@
+import mmap
+import struct
+import sys
+from argparse import ArgumentParser
+from array import array
+from collections import defaultdict
+from itertools import combinations_with_replacement, product
+from math import inf
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from chest.models import Position, Color
+from chest.geometry import geometry, KING_DIRECTIONS, STRAIGHT_DIRECTIONS, DIAGONAL_DIRECTIONS
+from chest.utils import calculate_moves, move_name
+
+# A table holds every placement of one set of pieces (its signature, e.g.
+# KRvK) with either side to move. Each entry is one signed byte for the side
+# to move: 0 is a draw, d + 1 a win and -(d + 1) a loss, d plies from the
+# end. Wins and losses follow the search's own rules: taking the king or a
+# king that can't move and is attacked ends the game, and so does having no
+# moves at all. Knights and pawns don't move, as in calculate_moves.
+#
+# File layout: header, then one directory entry per table, then the tables.
+MAGIC = b'CHTB'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+ENTRY = struct.Struct('<8sQQ')
+DEFAULT_PATH = Path(__file__).with_name('tablebase.bin')
+
+PIECE_ORDER = 'kqrbnp'
+MAX_DTM = 126
+
+SIZE = 8
+GEO = geometry(SIZE, SIZE)
+# the eight symmetries of the board; every piece moves the same in all of them
+SYMMETRIES = tuple(tuple(y * SIZE + x for x, y in (f(i % SIZE, i // SIZE) for i in range(SIZE * SIZE))) for f in (
+    lambda x, y: (x, y), lambda x, y: (7 - x, y), lambda x, y: (x, 7 - y), lambda x, y: (7 - x, 7 - y),
+    lambda x, y: (y, x), lambda x, y: (7 - y, x), lambda x, y: (y, 7 - x), lambda x, y: (7 - y, 7 - x)))
+# the white king is always moved into the a8-d8-d5 triangle. On its diagonal
+# two symmetries do that, and the one giving the smaller index is used, so
+# that equivalent positions always share an entry.
+TRIANGLE = tuple(y * SIZE + x for y in range(4) for x in range(y, 4))
+TRIANGLE_INDEX = {sq: i for i, sq in enumerate(TRIANGLE)}
+CANONICAL = tuple(tuple(sym for sym in SYMMETRIES if sym[sq] in TRIANGLE_INDEX) for sq in range(SIZE * SIZE))
+
+_DIRECTIONS = {'q': KING_DIRECTIONS, 'r': STRAIGHT_DIRECTIONS, 'b': DIAGONAL_DIRECTIONS}
+# per piece and square, the rays it moves along; a king's rays are one step long
+RAYS = {p: tuple(tuple(GEO.rays[d][sq] for d in directions) for sq in range(SIZE * SIZE))
+        for p, directions in _DIRECTIONS.items()}
+RAYS['k'] = tuple(tuple((s,) for s in steps) for steps in GEO.king_steps)
+RAYS['n'] = RAYS['p'] = ((),) * (SIZE * SIZE)
+
+
+def parse_signature(name: str) -> str:
+    # 'KRvK' -> 'KRk': white pieces upper case, black lower case, kings first
+    white, sep, black = name.upper().partition('V')
+    slots = []
+    for part, case in ((white, str.upper), (black, str.lower)):
+        pieces = sorted(part.lower(), key=lambda p: PIECE_ORDER.index(p) if p in PIECE_ORDER else -1)
+        if not sep or pieces.count('k') != 1 or any(p not in PIECE_ORDER for p in pieces):
+            raise ValueError(f"bad signature {name!r}: expected something like KRvK")
+        slots += [case(p) for p in pieces]
+    return ''.join(slots)
+
+
+def signature_name(slots: str) -> str:
+    return ''.join(p for p in slots if p.isupper()) + 'v' + ''.join(p.upper() for p in slots if p.islower())
+
+
+def table_size(pieces: int) -> int:
+    return len(TRIANGLE) * 64 ** (pieces - 1) * 2
+
+
+def index(squares: Tuple[int, ...], black: int) -> int:
+    best = None
+    for sym in CANONICAL[squares[0]]:
+        idx = TRIANGLE_INDEX[sym[squares[0]]]
+        for sq in squares[1:]:
+            idx = idx << 6 | sym[sq]
+        if best is None or idx < best:
+            best = idx
+    return best << 1 | black
+
+
+def decode(idx: int, pieces: int) -> Tuple[int, ...]:
+    squares = []
+    idx >>= 1
+    for _ in range(pieces - 1):
+        squares.append(idx & 63)
+        idx >>= 6
+    squares.append(TRIANGLE[idx])
+    return tuple(reversed(squares))
+
+
+def _attacked(slots: str, squares: Tuple[int, ...], occupant: List[int], target: int, by_white: bool) -> bool:
+    for i, p in enumerate(slots):
+        if p.isupper() == by_white:
+            for ray in RAYS[p.lower()][squares[i]]:
+                for s in ray:
+                    if s == target:
+                        return True
+                    if occupant[s] >= 0:
+                        break
+    return False
+
+
+def _terminal(slots: str, squares: Tuple[int, ...], occupant: List[int]) -> Optional[bool]:
+    # the same test as evaluate._terminal: True if white has won, False if black has
+    for king, white in ((slots.index('K'), True), (slots.index('k'), False)):
+        sq = squares[king]
+        if all(occupant[s] >= 0 and slots[occupant[s]].isupper() == white for s in GEO.king_steps[sq]) \
+                and _attacked(slots, squares, occupant, sq, not white):
+            return not white
+    return None
+
+
+def generate(name: str, tables: Dict[str, array], log=None) -> array:
+    # Retrograde analysis: resolve the positions whose outcome is known from
+    # the start (terminal, no moves, or decided by a capture into a smaller
+    # table), then work backwards one ply at a time through un-moves.
+    slots = parse_signature(name)
+    pieces = len(slots)
+    size = table_size(pieces)
+    white = [p.isupper() for p in slots]
+    rays = [RAYS[p.lower()] for p in slots]
+    # after taking the piece in slot j, the position continues in this table
+    smaller = [None if p in 'Kk' else tables[signature_name(slots[:j] + slots[j + 1:])]
+               for j, p in enumerate(slots)]
+    started = perf_counter()
+
+    values = array('b', bytes(size))
+    remaining = array('B', bytes(size))
+    loss_floor = array('b', [-1]) * size
+    no_loss = bytearray(size)
+    resolved = defaultdict(list)
+    capture_wins = defaultdict(list)
+
+    def resolve(idx: int, dtm: int, win: bool):
+        if dtm > MAX_DTM:
+            raise ValueError(f"{name}: distance to mate {dtm} doesn't fit in a byte")
+        values[idx] = dtm + 1 if win else -dtm - 1
+        resolved[dtm].append(idx)
+
+    idx = 0
+    occupant = [-1] * 64
+    for king in TRIANGLE:
+        for rest in product(range(64), repeat=pieces - 1):
+            squares = (king,) + rest
+            # overlapping pieces, or the mirror image of an entry in use
+            if len(set(squares)) < pieces or index(squares, 0) != idx:
+                idx += 2
+                continue
+            for i, sq in enumerate(squares):
+                occupant[sq] = i
+            terminal = _terminal(slots, squares, occupant)
+            for black in (0, 1):
+                if terminal is not None:
+                    resolve(idx, 0, terminal != bool(black))
+                    idx += 1
+                    continue
+                children = set()
+                captures = 0
+                win_level = None
+                for i in range(pieces):
+                    if white[i] == bool(black):
+                        continue
+                    for ray in rays[i][squares[i]]:
+                        for s in ray:
+                            j = occupant[s]
+                            if j < 0:
+                                children.add(index(squares[:i] + (s,) + squares[i + 1:], 1 - black))
+                                continue
+                            if white[j] != white[i]:
+                                captures += 1
+                                table = smaller[j]
+                                if table is None:
+                                    value = -1
+                                else:
+                                    moved = squares[:i] + (s,) + squares[i + 1:]
+                                    value = table[index(moved[:j] + moved[j + 1:], 1 - black)]
+                                if value < 0:
+                                    win_level = -value - 1 if win_level is None else min(win_level, -value - 1)
+                                elif value > 0:
+                                    loss_floor[idx] = max(loss_floor[idx], value - 1)
+                                else:
+                                    no_loss[idx] = 1
+                            break
+                remaining[idx] = len(children)
+                if win_level is not None:
+                    no_loss[idx] = 1
+                    capture_wins[win_level].append(idx)
+                elif not children and not no_loss[idx]:
+                    # nothing to move, or every capture loses
+                    resolve(idx, loss_floor[idx] + 1 if captures else 0, False)
+                idx += 1
+            for sq in squares:
+                occupant[sq] = -1
+
+    level = 0
+    while resolved or capture_wins:
+        for p in capture_wins.pop(level, ()):
+            if not values[p]:
+                resolve(p, level + 1, True)
+        for q in resolved.pop(level, ()):
+            lost = values[q] < 0
+            black = q & 1
+            squares = decode(q, pieces)
+            for i, sq in enumerate(squares):
+                occupant[sq] = i
+            parents = set()
+            # un-move a piece of the side that just moved to any square it could have come from
+            for i in range(pieces):
+                if white[i] == bool(black):
+                    for ray in rays[i][squares[i]]:
+                        for s in ray:
+                            if occupant[s] >= 0:
+                                break
+                            parents.add(index(squares[:i] + (s,) + squares[i + 1:], 1 - black))
+            for sq in squares:
+                occupant[sq] = -1
+            for p in parents:
+                if values[p]:
+                    continue
+                if lost:
+                    resolve(p, level + 1, True)
+                else:
+                    remaining[p] -= 1
+                    if not remaining[p] and not no_loss[p]:
+                        resolve(p, max(level, loss_floor[p]) + 1, False)
+        level += 1
+
+    if log is not None:
+        wins = sum(1 for v in values if v > 0)
+        losses = sum(1 for v in values if v < 0)
+        log(f"{signature_name(slots)}: {size} entries, {wins} wins, {losses} losses, "
+            f"longest {max(map(abs, values)) - 1} plies, {perf_counter() - started:.1f}s")
+    return values
+
+
+def requirements(name: str) -> List[str]:
+    # name and every table a capture can lead to, smallest first
+    slots = parse_signature(name)
+    needed = {signature_name(slots)}
+    for j, p in enumerate(slots):
+        if p not in 'Kk':
+            needed.update(requirements(signature_name(slots[:j] + slots[j + 1:])))
+    return sorted(needed, key=lambda n: (len(n), n))
+
+
+def all_signatures(pieces: int) -> List[str]:
+    # white pieces are upper case, black lower case, as on the board
+    extras = PIECE_ORDER[1:].upper() + PIECE_ORDER[1:]
+    return [signature_name('K' + ''.join(p for p in combo if p.isupper()) + 'k' + ''.join(p for p in combo if p.islower()))
+            for count in range(pieces - 1) for combo in combinations_with_replacement(extras, count)]
+
+
+def write(path: Path, tables: Dict[str, array]):
+    names = sorted(tables, key=lambda n: (len(n), n))
+    offset = HEADER.size + ENTRY.size * len(names)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(names)))
+        for name in names:
+            f.write(ENTRY.pack(name.encode(), offset, len(tables[name])))
+            offset += len(tables[name])
+        for name in names:
+            tables[name].tofile(f)
+
+
+class Tablebase:
+    def __init__(self, path: Path = DEFAULT_PATH):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"{self.path} is not a version {VERSION} tablebase")
+        self.values = memoryview(self.mm).cast('b')
+        self.tables: Dict[str, Tuple[int, int]] = {}
+        for i in range(count):
+            name, offset, size = ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+            self.tables[name.rstrip(b'\0').decode()] = offset, size
+        self.max_pieces = max((len(name) - 1 for name in self.tables), default=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.values.release()
+        self.mm.close()
+
+    def __getstate__(self):
+        # worker processes map the file again rather than copying it
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def table(self, name: str) -> array:
+        offset, size = self.tables[name]
+        values = array('b')
+        values.frombytes(self.mm[offset:offset + size])
+        return values
+
+    def probe(self, pos: Position, black: bool) -> Optional[int]:
+        # the raw entry for pos with black (or white) to move, if it's covered
+        if len(pos.white_pieces) + len(pos.black_pieces) > self.max_pieces \
+                or pos.white_king is None or pos.black_king is None \
+                or pos.board_width != SIZE or pos.board_height != SIZE:
+            return None
+        white = sorted(pos.white_pieces, key=lambda p: PIECE_ORDER.index(p[0]))
+        black_pieces = sorted(pos.black_pieces, key=lambda p: PIECE_ORDER.index(p[0]))
+        name = ''.join(p for p, _ in white).upper() + 'v' + ''.join(p for p, _ in black_pieces).upper()
+        entry = self.tables.get(name)
+        if entry is None:
+            return None
+        squares = tuple(idx for _, idx in white) + tuple(idx for _, idx in black_pieces)
+        return self.values[entry[0] + index(squares, int(black))]
+
+    def score(self, pos: Position, black: bool) -> Optional[float]:
+        # inf, -inf or 0 for the side to move
+        value = self.probe(pos, black)
+        if value is None:
+            return None
+        return inf if value > 0 else -inf if value < 0 else 0
+
+    def best_move(self, pos: Position, black: bool) -> Optional[Tuple[Tuple[int, int], float]]:
+        # the quickest win, the longest loss, or any move that keeps the draw
+        if self.probe(pos, black) is None:
+            return None
+        best, best_rank = None, None
+        for _, idx in list(pos.black_pieces if black else pos.white_pieces):
+            for move in calculate_moves(pos, idx):
+                if pos.board[move].lower() == 'k':
+                    return (idx, move), inf
+                pos.make_move(idx, move)
+                value = self.probe(pos, not black)
+                pos.unmake_move()
+                if value is None:
+                    continue
+                # child entries are for the opponent: a loss there is a win here
+                rank = (2, value) if value < 0 else (0, value) if value > 0 else (1, 0)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = (idx, move), rank
+        if best is None:
+            return None
+        return best, (inf, 0, -inf)[2 - best_rank[0]]
+
+
+def load_default() -> Optional[Tablebase]:
+    return Tablebase(DEFAULT_PATH) if DEFAULT_PATH.exists() else None
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.tablebase',
+                            description='build endgame tables by retrograde analysis, or probe them')
+    parser.add_argument('signatures', nargs='*', help='tables to build, e.g. KRvKR (default: all up to --pieces)')
+    parser.add_argument('--pieces', type=int, default=3, help='build every table with up to this many pieces')
+    parser.add_argument('-o', '--output', type=Path, default=DEFAULT_PATH,
+                        help='tables already in this file are kept and reused')
+    parser.add_argument('--probe', metavar='FEN', help='look a position up instead of building')
+    parser.add_argument('--color', choices=[c.value for c in Color], default=Color.white.value)
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        pos = Position.from_fen(args.probe)
+        black = args.color == Color.black
+        with Tablebase(args.output) as tb:
+            value = tb.probe(pos, black)
+            if value is None:
+                print(f"{args.probe} is not in {args.output}")
+                return 1
+            result = 'draw' if value == 0 else f"{'win' if value > 0 else 'loss'} in {abs(value) - 1} plies"
+            move, _ = tb.best_move(pos, black) or (None, None)
+            print(f"{args.probe} {args.color} to move: {result}" + (f", {move_name(pos, move)}" if move else ''))
+        return 0
+
+    try:
+        names = [signature_name(parse_signature(name)) for name in args.signatures] or all_signatures(args.pieces)
+    except ValueError as e:
+        parser.error(str(e))
+    tables: Dict[str, array] = {}
+    if args.output.exists():
+        with Tablebase(args.output) as tb:
+            for name in tb.tables:
+                tables[name] = tb.table(name)
+    for name in sorted({n for name in names for n in requirements(name)}, key=lambda n: (len(n), n)):
+        if name not in tables:
+            tables[name] = generate(name, tables, print)
+    write(args.output, tables)
+    print(f"wrote {len(tables)} tables to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
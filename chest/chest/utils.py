@@ -2,75 +2,92 @@ from chest.models import Color, Position, Piece
 from typing import List, Tuple
 from urllib.parse import quote_plus
 from webbrowser import open
-from functools import lru_cache
+from chest.cache import position_cache
+from chest.geometry import geometry, KING_DIRECTIONS, STRAIGHT_DIRECTIONS, DIAGONAL_DIRECTIONS
 
 
 def open_fen(fen: str):
     open("https://lichess.org/editor?fen=" + quote_plus(fen))
 
+def square_name(pos: Position, index: int) -> str:
+    return chr(index % pos.board_width + 97) + str(pos.board_height - index // pos.board_width)
+
+def move_name(pos: Position, move: Tuple[int, int]) -> str:
+    return square_name(pos, move[0]) + square_name(pos, move[1])
+
 def color_of_piece(piece: str) -> Color:
     return Color.white if piece.isupper() else Color.black
 
-@lru_cache(maxsize=6_000_000)
-def calculate_moves(position: Position, index: int) -> List[int]:
-    piece = position.board[index].lower()
-    color = color_of_piece(position.board[index])
-
-    moves = ()
-    if piece == Piece.king:
-        for i in range (-1, 2):
-            for j in range(-1, 2):
-                if i == 0 and j == 0:
-                    continue
-                moves += raycast(position, index, (i, j), color, 1)
-    elif piece == Piece.queen:
-        for i in range (-1, 2):
-            for j in range(-1, 2):
-                if i == 0 and j == 0:
-                    continue
-                moves += raycast(position, index, (i, j), color)
-    elif piece == Piece.rook:
-        moves += raycast(position, index, (1, 0), color)
-        moves += raycast(position, index, (-1, 0), color)
-        moves += raycast(position, index, (0, 1), color)
-        moves += raycast(position, index, (0, -1), color)
+SLIDER_DIRECTIONS = {
+    Piece.queen: KING_DIRECTIONS,
+    Piece.rook: STRAIGHT_DIRECTIONS,
+    Piece.bishop: DIAGONAL_DIRECTIONS,
+}
 
-    elif piece == Piece.bishop:
-        moves += raycast(position, index, (1, 1), color)
-        moves += raycast(position, index, (-1, 1), color)
-        moves += raycast(position, index, (-1, -1), color)
-        moves += raycast(position, index, (1, -1), color)
-    elif piece == Piece.knight:
-        pass
-    elif piece == Piece.pawn:
-        pass
+def walk(board: List[str], ray: Tuple[int, ...], white: bool) -> List[int]:
+    # squares along ray up to the first piece, including it if it's an enemy
+    moves = []
+    for square in ray:
+        p = board[square]
+        if p:
+            if p.isupper() != white:
+                moves.append(square)
+            break
+        moves.append(square)
     return moves
 
-def raycast(pos: Position, index: int, direction: Tuple[int, int], color: Color, limit: int = 0, step: int = 0):
-    if limit != 0 and step >= limit:
-        return ()
-    next_index = index
-    if index % pos.board_width == pos.board_width - 1 and direction[0] == 1:  # we are at the right edge
-        return ()
+@position_cache(max_mb=256)
+def calculate_moves(position: Position, index: int) -> Tuple[int, ...]:
+    board = position.board
+    piece = board[index].lower()
+    white = board[index].isupper()
+    geo = geometry(position.board_width, position.board_height)
 
-    if index % pos.board_width == 0 and direction[0] == -1:  # we are at the leftmost edge
-        return ()
+    if piece == Piece.king:
+        return tuple(s for s in geo.king_steps[index] if not board[s] or board[s].isupper() != white)
+    if piece in SLIDER_DIRECTIONS:
+        moves = []
+        for direction in SLIDER_DIRECTIONS[piece]:
+            moves += walk(board, geo.rays[direction][index], white)
+        return tuple(moves)
+    # knights and pawns don't move yet
+    return ()
 
-    if index >= (pos.board_width - 1) * pos.board_height and direction[1] == 1:  # we are moving into the bottom
-        return ()
+def first_capture(board: List[str], ray: Tuple[int, ...], white: bool) -> Tuple[int, ...]:
+    # the first piece along ray, if it's an enemy
+    for square in ray:
+        p = board[square]
+        if p:
+            return (square,) if p.isupper() != white else ()
+    return ()
 
-    if index <= pos.board_width and direction[1] == -1:  # we are moving into the top
-        return ()
+@position_cache(max_mb=128)
+def calculate_captures(position: Position, index: int) -> Tuple[int, ...]:
+    # the subset of calculate_moves that takes a piece, without walking the
+    # empty squares in between
+    board = position.board
+    piece = board[index].lower()
+    white = board[index].isupper()
+    geo = geometry(position.board_width, position.board_height)
 
-    # x component
-    next_index += direction[0]
-    # y component
-    next_index += 8 * direction[1]
+    if piece == Piece.king:
+        return tuple(s for s in geo.king_steps[index] if board[s] and board[s].isupper() != white)
+    if piece in SLIDER_DIRECTIONS:
+        rays = geo.rays
+        return tuple(s for direction in SLIDER_DIRECTIONS[piece]
+                     for s in first_capture(board, rays[direction][index], white))
+    return ()
 
-    if p := pos.board[next_index]:  # there is already a piece here
-        if color_of_piece(p) == color:
-            return ()  # we can't move into our own team
-        else:
-            return (next_index,)  # if there's a guy here it's the last stop
+@position_cache(max_mb=64)
+def attack_map(position: Position, color: Color) -> int:
+    # every square color's pieces can move to, as a bitmask; built once per
+    # position and shared by check, mate and legality tests
+    pieces = position.white_pieces if color == Color.white else position.black_pieces
+    mask = 0
+    for _, idx in pieces:
+        for move in calculate_moves(position, idx):
+            mask |= 1 << move
+    return mask
 
-    return (next_index,) + raycast(pos, next_index, direction, color, limit, step + 1)
\ No newline at end of file
+def is_attacked(position: Position, index: int, color: Color) -> bool:
+    return attack_map(position, color) >> index & 1 == 1
@@ -0,0 +1,72 @@
+from typing import Iterable
+
+from chest.models import Piece, Position, piece_values
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batch evaluation
+    np = None
+
+# int8 board encoding: white pieces positive, black pieces negative, 0 empty
+CODES = {
+    Piece.pawn: 1,
+    Piece.knight: 2,
+    Piece.bishop: 3,
+    Piece.rook: 4,
+    Piece.queen: 5,
+    Piece.king: 6,
+}
+CHAR_CODES = {'': 0}
+for _piece, _code in CODES.items():
+    CHAR_CODES[_piece.value.upper()] = _code
+    CHAR_CODES[_piece.value] = -_code
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for batch evaluation")
+
+
+def board_array(pos: Position):
+    _require_numpy()
+    return np.array([CHAR_CODES[c] for c in pos.board], dtype=np.int8)
+
+
+def board_arrays(positions: Iterable[Position]):
+    return np.stack([board_array(pos) for pos in positions])
+
+
+def child_boards(row, moves):
+    # boards after each (start, end) move from the position encoded in row
+    starts, ends = np.array(moves, dtype=np.intp).T
+    rows = np.repeat(row[None, :], len(moves), axis=0)
+    n = np.arange(len(moves))
+    rows[n, ends] = rows[n, starts]
+    rows[n, starts] = 0
+    return rows
+
+
+def material_table(squares: int = 64):
+    # table[code + 6, square] is the white-relative score of that piece on
+    # that square; piece-square terms are added on top of the material rows
+    _require_numpy()
+    values = np.zeros(13, dtype=np.int32)
+    for piece, code in CODES.items():
+        values[6 + code] = piece_values[piece]
+        values[6 - code] = -piece_values[piece]
+    return np.repeat(values[:, None], squares, axis=1)
+
+
+_tables = {}
+
+
+def score_boards(boards, table=None):
+    # white-relative score of every row of an (N, squares) int8 batch; with
+    # the default table this equals score_pieces for each position
+    _require_numpy()
+    squares = boards.shape[1]
+    if table is None:
+        if squares not in _tables:
+            _tables[squares] = material_table(squares)
+        table = _tables[squares]
+    return table[boards.astype(np.intp) + 6, np.arange(squares)].sum(axis=1)
@@ -0,0 +1,48 @@
+from random import Random
+from typing import Iterable, Optional
+
+PIECES = 'PNBRQKpnbrqk'
+
+# seeded so keys are stable across runs and processes
+_random = Random(0xC4E57)
+
+BLACK_TO_MOVE = _random.getrandbits(64)
+BLACK_PERSPECTIVE = _random.getrandbits(64)
+
+ZOBRIST = {c: [] for c in PIECES}
+
+
+def ensure_squares(squares: int):
+    # keys are drawn square by square, so growing the table never changes existing keys
+    while len(ZOBRIST[PIECES[0]]) < squares:
+        for c in PIECES:
+            ZOBRIST[c].append(_random.getrandbits(64))
+
+
+def board_key(board: Iterable[Optional[str]]) -> int:
+    board = list(board)
+    ensure_squares(len(board))
+    key = 0
+    for idx, c in enumerate(board):
+        if c:
+            key ^= ZOBRIST[c][idx]
+    return key
+
+
+def geometry_key(width: int, height: int) -> int:
+    # boards of other sizes can share piece placements with 8x8 ones, so
+    # their keys get a term of their own; 8x8 keys are left as they were
+    if (width, height) == (8, 8):
+        return 0
+    return Random(f"{width}x{height}").getrandbits(64)
+
+
+def search_key(key: int, black_to_move: bool, black: bool) -> int:
+    if black_to_move:
+        key ^= BLACK_TO_MOVE
+    if black:
+        key ^= BLACK_PERSPECTIVE
+    return key
+
+
+ensure_squares(64)
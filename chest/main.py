@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from chest.models import Piece, Color, Position
-from chest.evaluate import alpha_beta, evaluate, find_best_move
+from chest.evaluate import alpha_beta, evaluate, find_best_move, print_iteration
 from chest.utils import open_fen
+from chest.tablebase import load_default
+from chest.book import load_default as load_book
+from chest.persistent import PersistentTable
 
 
 
@@ -11,7 +14,8 @@ if __name__ == '__main__':
     #position = Position.from_fen("K7/8/7R/8/3rrrr1/8/ppp5/k7")
     #position = Position.from_fen("kr6/8/RK6/8/8/8/8/8")
 
-    start, end = find_best_move(position, Color.black, 6)
+    start, end = find_best_move(position, Color.black, 6, tt=PersistentTable(), tablebase=load_default(),
+                                book=load_book(), on_iteration=print_iteration)
     file = chr(end % position.board_width + 65)
     rank = position.board_height - end // position.board_width
     print(f"{position.board[start]} -> {file}{rank} ({start}, {end})")
@@ -0,0 +1,82 @@
+from sys import getsizeof
+
+from chest.cache import position_cache, SLOT_BYTES
+
+VALUE_BYTES = 1000
+MAX_MB = 0.01
+
+
+def cached():
+    calls = []
+
+    # ints stand in for positions, and are their own check word
+    @position_cache(max_mb=MAX_MB, check=int)
+    def value(position):
+        calls.append(position)
+        return bytes(VALUE_BYTES)
+
+    return value, calls
+
+
+def entry_bytes(position) -> int:
+    entry = position, (), bytes(VALUE_BYTES)
+    return 2 * getsizeof(position) + getsizeof(entry) + getsizeof(()) + getsizeof(bytes(VALUE_BYTES)) + SLOT_BYTES
+
+
+def test_stays_under_its_byte_bound():
+    value, calls = cached()
+    for position in range(1000):
+        value(position)
+    info = value.cache_info()
+    assert info.max_bytes == int(MAX_MB * 2**20)
+    assert info.bytes <= info.max_bytes
+    # about max_bytes worth of entries is kept; the rest were evicted
+    assert info.currsize <= info.max_bytes // entry_bytes(0) + 1
+    assert info.evictions > 0 and info.evictions + info.currsize == 1000
+    assert info.misses == len(calls) == 1000
+
+
+def test_entries_in_use_survive_eviction():
+    value, calls = cached()
+    for position in range(1000):
+        value(position)
+        # looked up again all the time, so never dropped
+        value(10_000)
+    assert calls.count(10_000) == 1
+    assert value.cache_info().hits == 1000 - 1
+
+
+def test_recomputes_what_was_evicted():
+    value, calls = cached()
+    for position in range(100):
+        value(position)
+    value(0)
+    assert calls.count(0) == 2
+    value(99)
+    assert calls.count(99) == 1
+
+
+def test_cache_clear():
+    value, calls = cached()
+    for position in range(100):
+        value(position)
+    value.cache_clear()
+    info = value.cache_info()
+    assert (info.hits, info.misses, info.currsize, info.bytes, info.evictions) == (0, 0, 0, 0, 0)
+    value(0)
+    assert calls.count(0) == 2
+
+
+def test_colliding_keys_do_not_share_values():
+    assert hash(-1) == hash(-2)
+
+    @position_cache(max_mb=MAX_MB, check=int)
+    def value(position, *args):
+        return position, args
+
+    assert value(-1) == (-1, ())
+    assert value(-2) == (-2, ())
+    # hash((-1,)) == hash((-2,)) too, so these share a key with each other
+    assert value(0, -1) == (0, (-1,))
+    assert value(0, -2) == (0, (-2,))
+    assert value.cache_info().hits == 0
@@ -0,0 +1,39 @@
+import pytest
+
+from chest.models import Position, Color
+from chest.mate import PUZZLES, find_mate
+from chest.search import SearchContext
+
+
+@pytest.mark.parametrize('fen, color, moves', PUZZLES)
+def test_finds_the_shortest_mate(fen, color, moves):
+    pos = Position.from_fen(fen)
+    found = find_mate(pos, color, moves + 1)
+    assert found is not None
+    assert found[0] == moves
+    assert find_mate(pos, color, moves - 1) is None
+
+
+@pytest.mark.parametrize('fen, color, moves', PUZZLES)
+def test_line_ends_by_taking_the_king(fen, color, moves):
+    pos = Position.from_fen(fen)
+    _, line = find_mate(pos, color, moves)
+    assert len(line) == 2 * moves - 1
+    for move in line[:-1]:
+        pos.make_move(*move)
+    assert pos.board[line[-1][1]].lower() == 'k'
+    for _ in line[:-1]:
+        pos.unmake_move()
+    # the line is found without leaving moves on the board
+    assert pos.to_fen() == fen
+
+
+def test_no_mate_in_a_drawn_ending():
+    assert find_mate(Position.from_fen('4k3/8/8/8/8/8/8/4K3'), Color.white, 3) is None
+
+
+def test_node_limit_gives_up():
+    fen, color, moves = PUZZLES[-1]
+    ctx = SearchContext()
+    assert find_mate(Position.from_fen(fen), color, moves, ctx, node_limit=10) is None
+    assert ctx.nodes <= 11
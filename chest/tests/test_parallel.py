@@ -0,0 +1,41 @@
+import pytest
+
+from chest.models import Position, Color
+from chest.bench import SUITE
+from chest.evaluate import alpha_beta
+from chest.parallel import RootSplitter
+from chest.search import SearchContext, SearchStats
+from chest.transposition import TranspositionTable
+
+SETTINGS = [
+    {'quiescence': False},
+    {'ordering': False},
+    {'null_move': True, 'reductions': True},
+    {'batch_leaves': True},
+]
+
+CASES = [('r3k2r/8/8/3q4/8/8/3Q4/R3K2R', Color.black, 4, {'quiescence': False})] + [
+    (fen, color, 3, settings) for fen, color in SUITE for settings in SETTINGS]
+
+
+@pytest.mark.parametrize('fen, color, depth, settings', CASES)
+def test_workers_search_with_the_callers_settings(fen, color, depth, settings):
+    black = color == Color.black
+    serial = alpha_beta(Position.from_fen(fen), SearchContext(tt=TranspositionTable(16), **settings), black, depth)
+    # a new splitter each time, so that no worker has entries from another search
+    with RootSplitter(2, tt_mb=32) as splitter:
+        parallel = splitter.search(Position.from_fen(fen), SearchContext(tt=TranspositionTable(16), **settings),
+                                   black, depth)
+    assert parallel == serial
+
+
+def test_workers_counts_reach_the_caller():
+    fen, color = SUITE[0]
+    ctx = SearchContext(tt=TranspositionTable(16), stats=SearchStats())
+    with RootSplitter(2, tt_mb=32) as splitter:
+        splitter.search(Position.from_fen(fen), ctx, color == Color.black, 3)
+    stats = ctx.stats
+    assert ctx.counter['cutoffs'] > 0 and ctx.counter['qnodes'] > 0
+    assert stats.counters == ctx.counter and stats.nodes == ctx.nodes
+    assert stats.tt_probes > 0 and stats.tt_hits <= stats.tt_probes
+    assert set(stats.phases) >= {'movegen', 'ordering', 'evaluate'}
@@ -0,0 +1,76 @@
+import random
+from math import inf
+
+import pytest
+
+from chest.models import Position
+from chest.evaluate import alpha_beta
+from chest.parallel import RootSplitter
+from chest.search import SearchContext
+from chest.tablebase import Tablebase, generate, requirements, write
+
+# plies alpha_beta looks ahead when checking the tables
+DEPTH = 4
+SAMPLES = 300
+
+
+@pytest.fixture(scope='module')
+def tablebase(tmp_path_factory):
+    tables = {}
+    for name in requirements('KRvK') + requirements('KQvK'):
+        if name not in tables:
+            tables[name] = generate(name, tables)
+    path = tmp_path_factory.mktemp('tablebase') / 'tablebase.bin'
+    write(path, tables)
+    with Tablebase(path) as tb:
+        yield tb
+
+
+def random_positions(rng: random.Random, count: int):
+    # white king and queen or rook against the black king, either side to move
+    for _ in range(count):
+        board = [''] * 64
+        for piece, square in zip(('K', rng.choice('QR'), 'k'), rng.sample(range(64), 3)):
+            board[square] = piece
+        fen = '/'.join(''.join(c or '1' for c in board[row:row + 8]) for row in range(0, 64, 8))
+        yield Position.from_fen(fen), rng.random() < 0.5
+
+
+def test_probe_agrees_with_alpha_beta(tablebase):
+    # a win or loss d plies from the end is found by a search at least d deep,
+    # and nothing else is
+    for pos, black in random_positions(random.Random(316), SAMPLES):
+        value = tablebase.probe(pos, black)
+        assert value is not None
+        _, score = alpha_beta(pos, SearchContext(quiescence=False), black, DEPTH)
+        if 0 < value <= DEPTH + 1:
+            assert score == inf, (pos.to_fen(), black, value, score)
+        elif -DEPTH - 1 <= value < 0:
+            assert score == -inf, (pos.to_fen(), black, value, score)
+        else:
+            assert score not in (inf, -inf), (pos.to_fen(), black, value, score)
+
+
+def test_best_move_keeps_the_win(tablebase):
+    for pos, black in random_positions(random.Random(7), 50):
+        value = tablebase.probe(pos, black)
+        if value <= 2:
+            # a draw, a loss, or the king is taken next move
+            continue
+        move, _ = tablebase.best_move(pos, black)
+        pos.make_move(*move)
+        # one ply closer to the end, now from the loser's side
+        assert tablebase.probe(pos, not black) == -(value - 1)
+        pos.unmake_move()
+
+
+def test_probe_ignores_positions_it_does_not_cover(tablebase):
+    pos = Position.from_fen('4k3/8/8/8/8/8/8/3RK2R')
+    assert tablebase.probe(pos, False) is None
+
+
+def test_workers_probe_the_tables(tablebase):
+    for pos, black in random_positions(random.Random(21), 10):
+        serial = alpha_beta(pos, SearchContext(tablebase=tablebase), black, DEPTH)
+        with RootSplitter(2, tt_mb=4, tablebase=tablebase.path) as splitter:
+            assert splitter.search(pos, SearchContext(tablebase=tablebase), black, DEPTH) == serial, pos.to_fen()
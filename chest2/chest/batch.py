@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+from argparse import ArgumentParser, FileType
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import isinf
+from time import perf_counter
+from typing import Iterable, Iterator, Optional, Tuple
+
+from chest.models import Color
+from chest.evaluate import iterative_deepening
+from chest.perft import BACKENDS
+from chest.search import SearchContext
+from chest.transposition import TranspositionTable, DEFAULT_SIZE_MB
+from chest.utils import move_name
+
+COLORS = {'w': Color.white, 'b': Color.black, 'white': Color.white, 'black': Color.black}
+
+# Every worker keeps one search context for its whole life, so its
+# transposition table stays warm between positions.
+_ctx: Optional[SearchContext] = None
+_limits: Tuple[int, Optional[float], Optional[int]] = (3, None, None)
+_backend = BACKENDS['bitboard']
+
+
+def _init_worker(backend: str, tt_mb: float, max_depth: int, time_limit: Optional[float], node_limit: Optional[int]):
+    global _ctx, _limits, _backend
+    _ctx = SearchContext(tt=TranspositionTable(tt_mb))
+    _limits = max_depth, time_limit, node_limit
+    _backend = BACKENDS[backend]
+
+
+def parse_line(line: str, color: Color) -> Tuple[str, Color]:
+    # the board field of a FEN, optionally followed by the side to move
+    fields = line.split()
+    if len(fields) > 1:
+        if fields[1].lower() not in COLORS:
+            raise ValueError(f"unknown side to move {fields[1]!r}")
+        color = COLORS[fields[1].lower()]
+    return fields[0], color
+
+
+def _score(score: float):
+    # JSON has no infinity
+    return ('+inf' if score > 0 else '-inf') if isinf(score) else score
+
+
+def analyse(line: str, color: Color, limits: Optional[Tuple[int, Optional[float], Optional[int]]] = None) -> dict:
+    # limits, if given, replace the worker's own for this position
+    max_depth, time_limit, node_limit = limits or _limits
+    try:
+        fen, color = parse_line(line, color)
+        pos = _backend.from_fen(fen)
+    except (ValueError, IndexError, KeyError) as e:
+        return {'fen': line, 'error': str(e)}
+
+    # killers and history belong to one game tree
+    _ctx.killers.clear()
+    _ctx.history.clear()
+    nodes, start = _ctx.nodes, perf_counter()
+    move, score, iterations = iterative_deepening(pos, color, max_depth, time_limit, node_limit, _ctx)
+    return {
+        'fen': fen,
+        'color': color.name,
+        'move': move_name(pos, move) if move is not None else None,
+        'score': _score(score),
+        'depth': iterations[-1].depth if iterations else 0,
+        'pv': [move_name(pos, m) for m in _ctx.pv],
+        'nodes': _ctx.nodes - nodes,
+        'seconds': round(perf_counter() - start, 6),
+    }
+
+
+def analyse_all(lines: Iterable[str], color: Color, workers: int = 1, tt_mb: float = DEFAULT_SIZE_MB,
+                max_depth: int = 3, time_limit: Optional[float] = None,
+                node_limit: Optional[int] = None, backend: str = 'bitboard') -> Iterator[dict]:
+    lines = (line.strip() for line in lines)
+    lines = (line for line in lines if line and not line.startswith('#'))
+    if workers <= 1:
+        _init_worker(backend, tt_mb, max_depth, time_limit, node_limit)
+        for line in lines:
+            yield analyse(line, color)
+        return
+
+    # results come back in input order; only a few positions per worker are
+    # queued at a time so that long inputs are streamed, not read up front
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(backend, tt_mb / workers, max_depth, time_limit, node_limit)) as pool:
+        pending = deque()
+        for line in lines:
+            pending.append(pool.submit(analyse, line, color))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.batch',
+                            description='analyse one FEN per line and write the results as JSON lines')
+    parser.add_argument('input', nargs='?', type=FileType('r'), default=sys.stdin,
+                        help='file of FENs, each optionally followed by w or b (default: stdin)')
+    parser.add_argument('-o', '--output', type=FileType('w'), default=sys.stdout)
+    parser.add_argument('--color', choices=[c.name for c in Color], default='white',
+                        help='side to move when a line does not say')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--time', type=float, help='seconds per position')
+    parser.add_argument('--nodes', type=int, help='nodes per position')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--hash', type=float, default=DEFAULT_SIZE_MB,
+                        help='transposition table megabytes, shared out between workers')
+    parser.add_argument('--backend', choices=BACKENDS, default='bitboard')
+    args = parser.parse_args(argv)
+
+    count = 0
+    start = perf_counter()
+    for result in analyse_all(args.input, Color[args.color], args.workers, args.hash,
+                              args.depth, args.time, args.nodes, args.backend):
+        args.output.write(json.dumps(result) + '\n')
+        args.output.flush()
+        count += 1
+    seconds = perf_counter() - start
+    print(f"{count} positions in {seconds:.3f}s ({count / max(seconds, 1e-9):.2f} positions/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
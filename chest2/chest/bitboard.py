@@ -0,0 +1,164 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Tuple
+from itertools import chain
+
+from chest.models import Position, Color, PieceType, SLIDER_DIRECTIONS, CHAR_CODES, color_sign, \
+    straight_directions, diagonal_directions
+from chest.geometry import Geometry, geometry
+
+
+def _mask(squares) -> int:
+    mask = 0
+    for s in squares:
+        mask |= 1 << s
+    return mask
+
+
+all_directions = straight_directions + diagonal_directions
+
+
+class BitboardTables:
+    # the geometry tables again, as masks
+    def __init__(self, geo: Geometry):
+        self.rays = geo.rays
+        self.ray_masks = {d: tuple(_mask(ray) for ray in geo.rays[d]) for d in all_directions}
+        # rays running towards higher indices meet their first blocker at the lowest set bit
+        self.forward = {d: d[0] + geo.width * d[1] > 0 for d in all_directions}
+        self.king_steps = geo.king_steps
+        self.king_masks = tuple(_mask(steps) for steps in geo.king_steps)
+        # keyed by the sign of the pawn's code
+        self.pawn_pushes = {1: geo.pawn_pushes[-1], -1: geo.pawn_pushes[1]}
+
+    def first_blocker(self, direction: Tuple[int, int], blockers: int) -> int:
+        if self.forward[direction]:
+            return (blockers & -blockers).bit_length() - 1
+        return blockers.bit_length() - 1
+
+    def slide(self, index: int, direction: Tuple[int, int], enemy: int, occupied: int) -> Tuple[int, ...]:
+        ray = self.rays[direction][index]
+        blockers = self.ray_masks[direction][index] & occupied
+        if not blockers:
+            return ray
+        blocker = self.first_blocker(direction, blockers)
+        stop = ray.index(blocker)
+        if enemy >> blocker & 1:
+            return ray[:stop + 1]
+        return ray[:stop]
+
+
+@lru_cache(maxsize=None)
+def bitboard_tables(width: int, height: int) -> BitboardTables:
+    return BitboardTables(geometry(width, height))
+
+
+class BitboardPosition(Position):
+    __slots__ = ('tables', 'bitboards', 'occupancy')
+
+    def __init__(self, height: int, width: int, board: Iterable[int]):
+        super().__init__(height, width, board)
+        self.tables = bitboard_tables(width, height)
+        # one mask per piece code, and per side keyed by sign
+        self.bitboards: Dict[int, int] = {code: 0 for code in CHAR_CODES.values()}
+        self.occupancy: Dict[int, int] = {1: 0, -1: 0}
+        for idx, code in enumerate(self.board):
+            if code:
+                self._toggle(code, 1 << idx)
+
+    def copy(self) -> 'BitboardPosition':
+        position = super().copy()
+        position.tables = self.tables
+        position.bitboards = self.bitboards.copy()
+        position.occupancy = self.occupancy.copy()
+        return position
+
+    def _toggle(self, code: int, mask: int):
+        self.bitboards[code] ^= mask
+        self.occupancy[1 if code > 0 else -1] ^= mask
+
+    def make_move(self, start: int, end: int):
+        piece = self.board[start]
+        captured = self.board[end]
+        super().make_move(start, end)
+        self._toggle(piece, (1 << start) | (1 << end))
+        if captured:
+            self._toggle(captured, 1 << end)
+
+    def unmake_move(self):
+        start, end, piece, captured = self.history[-1]
+        super().unmake_move()
+        self._toggle(piece, (1 << start) | (1 << end))
+        if captured:
+            self._toggle(captured, 1 << end)
+
+    def get_moves(self, index: int) -> Tuple[int, ...]:
+        code = self.board[index]
+        sign = 1 if code > 0 else -1
+        own = self.occupancy[sign]
+        enemy = self.occupancy[-sign]
+        kind = abs(code)
+        tables = self.tables
+        if kind == PieceType.king:
+            return tuple(s for s in tables.king_steps[index] if not own >> s & 1)
+        if kind == PieceType.pawn:
+            pushes = tables.pawn_pushes[sign][index]
+            occupied = own | enemy
+            if not pushes or occupied >> pushes[0] & 1:
+                return ()
+            if len(pushes) == 2 and occupied >> pushes[1] & 1:
+                return pushes[:1]
+            return pushes
+        if kind in SLIDER_DIRECTIONS:
+            occupied = own | enemy
+            return tuple(chain(*(tables.slide(index, d, enemy, occupied) for d in SLIDER_DIRECTIONS[kind])))
+        return ()
+
+    def get_captures(self, index: int) -> Tuple[int, ...]:
+        # in the same order as get_moves, so both backends break ties alike
+        code = self.board[index]
+        sign = 1 if code > 0 else -1
+        enemy = self.occupancy[-sign]
+        kind = abs(code)
+        tables = self.tables
+        if kind == PieceType.king:
+            return tuple(s for s in tables.king_steps[index] if enemy >> s & 1)
+        if kind in SLIDER_DIRECTIONS:
+            occupied = self.occupancy[sign] | enemy
+            ray_masks = tables.ray_masks
+            captures = []
+            for d in SLIDER_DIRECTIONS[kind]:
+                blockers = ray_masks[d][index] & occupied
+                if blockers:
+                    blocker = tables.first_blocker(d, blockers)
+                    if enemy >> blocker & 1:
+                        captures.append(blocker)
+            return tuple(captures)
+        return ()
+
+    def _attack_mask(self, index: int, own: int, occupied: int) -> int:
+        kind = abs(self.board[index])
+        tables = self.tables
+        if kind == PieceType.king:
+            return tables.king_masks[index] & ~own
+        if kind == PieceType.pawn:
+            return _mask(self.get_moves(index))
+        ray_masks = tables.ray_masks
+        mask = 0
+        for d in SLIDER_DIRECTIONS.get(kind, ()):
+            ray = ray_masks[d][index]
+            blockers = ray & occupied
+            if blockers:
+                ray ^= ray_masks[d][tables.first_blocker(d, blockers)]
+            mask |= ray
+        return mask & ~own
+
+    def _attack_map(self, color: Color) -> int:
+        sign = color_sign(color)
+        own = self.occupancy[sign]
+        occupied = own | self.occupancy[-sign]
+        mask = 0
+        pieces = own
+        while pieces:
+            low = pieces & -pieces
+            mask |= self._attack_mask(low.bit_length() - 1, own, occupied)
+            pieces ^= low
+        return mask
@@ -1,7 +1,28 @@
-from chest.models import Position, Chessman, Piece, Color
+from chest.models import Position, Color, color_sign, SLIDER_DIRECTIONS
 from math import inf
 from functools import lru_cache
 from datetime import datetime
+from typing import List, Optional, Tuple
+
+from chest.transposition import TranspositionTable, EXACT, LOWER, UPPER
+from chest.zobrist import search_key
+from chest.search import SearchContext, SearchTimeout, IterationInfo, SearchStats
+from chest.book import Book
+from chest.ordering import order_moves, staged_moves, order_captures, record_cutoff, order_value
+from chest.vector import board_array, child_boards, score_boards
+from time import monotonic
+
+# Evaluation is material only, so a capture can't gain more than the piece it
+# takes; the margin leaves room for a capture sequence that ends in mate.
+DELTA_MARGIN = 2
+
+# Scores are whole pawns, so (b - 1, b) is a null window.
+NULL_MOVE_REDUCTION = 2
+# quiet moves after the first LMR_FULL_MOVES are searched a ply shallower
+# first, and only searched in full if they turn out to raise alpha
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+ASPIRATION_WINDOW = 1
 
 
 def alphabeta_max(pos: Position, alpha: float, beta: float, depth: int):
@@ -38,53 +59,330 @@ def next_position2(pos: Position, color: Color, depth=3):
     return highscore, best
 
 
-def next_position(pos, color: Color, depth=3):
-    now = datetime.now()
-    best_pos = pos
+def root_moves(pos: Position, color: Color, ctx: SearchContext):
+    root_key = search_key(pos.key, color == Color.black, color == Color.black)
+    entry = ctx.tt.probe(root_key)
+    return root_key, order_moves(pos, pos.get_move_list(color), ctx, 0, entry[3] if entry is not None else None)
+
+
+def search_root(pos: Position, color: Color, depth: int, ctx: SearchContext, a: float = -inf, b: float = inf):
+    root_key, moves = root_moves(pos, color, ctx)
     best_score = -inf
     best_depth = 0
-    for child in pos.get_children(color):
-        score, child_depth = alpha_beta(child, ~color, color == Color.black, depth, maximizing=False)
-        print(child, score, child_depth)
+    best_move = None
+    for start, end in moves:
+        pos.make_move(start, end)
+        score, child_depth = alpha_beta(pos, ~color, color == Color.black, depth, a, b, maximizing=False, ctx=ctx)
+        pos.unmake_move()
         if score > best_score:
-            best_pos = child
+            best_move = (start, end)
             best_score = score
         elif score == best_score and child_depth >= best_depth:
             best_depth = child_depth
-            best_pos = child
+            best_move = (start, end)
             best_score = score
 
-    print(f"CHOSE {best_pos} {best_score} {best_depth} in {datetime.now() - now}")
+    if best_move is not None:
+        flag = UPPER if best_score <= a else LOWER if best_score >= b else EXACT
+        ctx.tt.store(root_key, depth + 1, flag, best_score, best_move)
+    return best_score, best_move, best_depth
+
+
+def principal_variation(pos: Position, color: Color, tt: TranspositionTable, max_depth: int):
+    pv = []
+    seen = set()
+    side = color
+    for _ in range(max_depth):
+        key = search_key(pos.key, side == Color.black, color == Color.black)
+        entry = tt.probe(key)
+        if entry is None or entry[3] is None or key in seen:
+            break
+        start, end = entry[3]
+        if pos.board[start] * color_sign(side) <= 0 or end not in pos.get_moves(start):
+            break
+        seen.add(key)
+        pv.append(entry[3])
+        pos.make_move(start, end)
+        side = ~side
+    for _ in pv:
+        pos.unmake_move()
+    return pv
+
+
+def iterative_deepening(pos: Position, color: Color, max_depth: int = 3, time_limit: Optional[float] = None,
+                        node_limit: Optional[int] = None, ctx: Optional[SearchContext] = None, on_iteration=None,
+                        root_search=None, pv: Optional[List[Tuple[int, int]]] = None):
+    if root_search is None:
+        root_search = search_root
+    if ctx is None:
+        ctx = SearchContext(tt=TranspositionTable())
+    if ctx.tt is None:
+        ctx.tt = TranspositionTable()
+    ctx.tt.new_search()
+    # a line expected from an earlier search is tried first until this one has its own
+    ctx.pv = list(pv) if pv else []
+    ctx.set_budget(time_limit, node_limit)
+    limits = ctx.deadline, ctx.node_limit
+    root_ply = len(pos.history)
+    stats = ctx.stats
+    if stats is not None:
+        started = monotonic()
+
+    best_move, best_score = None, -inf
+    iterations = []
+    for depth in range(max_depth + 1):
+        # the first iteration always finishes so there is a move to return
+        ctx.deadline, ctx.node_limit = limits if depth > 0 else (None, None)
+        start, nodes = monotonic(), ctx.nodes
+        try:
+            a, b = -inf, inf
+            if ctx.aspiration and iterations and best_score not in (inf, -inf):
+                a, b = best_score - ASPIRATION_WINDOW, best_score + ASPIRATION_WINDOW
+            while True:
+                score, move, _ = root_search(pos, color, depth, ctx, a, b)
+                # outside the window the score is only a bound: open that side and search again
+                if a > -inf and score <= a:
+                    a = -inf
+                elif b < inf and score >= b:
+                    b = inf
+                else:
+                    break
+                ctx.counter['aspiration_researches'] += 1
+        except SearchTimeout:
+            while len(pos.history) > root_ply:
+                pos.unmake_move()
+            break
+        best_move, best_score = move, score
+        ctx.pv = principal_variation(pos, color, ctx.tt, depth + 1)
+        info = IterationInfo(depth, score, move, ctx.pv, ctx.nodes - nodes, monotonic() - start)
+        iterations.append(info)
+        if stats is not None:
+            stats.depth = depth
+        if on_iteration is not None:
+            on_iteration(info)
+        if score in (inf, -inf):
+            break
+    ctx.deadline = ctx.node_limit = None
+    if stats is not None:
+        stats.seconds += monotonic() - started
+        ctx.report()
+    return best_move, best_score, iterations
+
+
+def print_iteration(info: IterationInfo):
+    print(f"depth {info.depth}: score {info.score} move {info.move} nodes {info.nodes} nps {info.nps:.0f}")
+
+
+def next_position(pos, color: Color, depth=3, tt: Optional[TranspositionTable] = None,
+                  time_limit: Optional[float] = None, node_limit: Optional[int] = None, workers: int = 1,
+                  stats: Optional[SearchStats] = None, book: Optional[Book] = None, on_iteration=None):
+    now = datetime.now()
+    move = book.choose(pos, color) if book is not None else None
+    if move is not None:
+        # book moves aren't searched, so they have no score of their own
+        best_pos = pos.perform_move(*move)
+        print(f"BOOK {best_pos} in {datetime.now() - now}")
+        return 0, best_pos
+    ctx = SearchContext(tt=tt, stats=stats)
+    if workers > 1:
+        from chest.parallel import RootSplitter
+        with RootSplitter(workers) as splitter:
+            best_move, best_score, _ = iterative_deepening(pos, color, depth, time_limit, node_limit,
+                                                           ctx, on_iteration, splitter.search)
+    else:
+        best_move, best_score, _ = iterative_deepening(pos, color, depth, time_limit, node_limit,
+                                                       ctx, on_iteration)
+    best_pos = pos
+    if best_move is not None:
+        best_pos = pos.perform_move(*best_move)
+    print(f"CHOSE {best_pos} {best_score} in {datetime.now() - now}")
     return best_score, best_pos
 
-def alpha_beta(pos: Position, color: Color, for_black: bool, depth: int, a: float = -inf, b: float = inf, maximizing: bool = True):
-    pos_score = evaluate(pos, for_black)
+def alpha_beta(pos: Position, color: Color, for_black: bool, depth: int, a: float = -inf, b: float = inf, maximizing: bool = True, ctx: Optional[SearchContext] = None, ply: int = 1, null_ok: bool = True):
+    if ctx is None:
+        ctx = SearchContext()
+    ctx.visit()
+    with ctx.phase('evaluate'):
+        pos_score = evaluate(pos, for_black)
+    if depth == 0 and ctx.quiescence and pos_score not in (inf, -inf):
+        return quiescence(pos, color, for_black, a, b, maximizing, ctx, pos_score), 0
     if depth == 0 or pos_score in (inf, -inf):
         return pos_score, depth
 
+    tt = ctx.tt
+    key = search_key(pos.key, color == Color.black, for_black)
+    tt_move = None
+    if tt is not None:
+        entry = tt.probe(key)
+        if ctx.stats is not None:
+            ctx.probed(entry is not None)
+        if entry is not None:
+            tt_depth, flag, score, tt_move, plies = entry
+            if tt_depth >= depth and (
+                    flag == EXACT or (flag == LOWER and score >= b) or (flag == UPPER and score <= a)):
+                ctx.counter['tt_cutoffs'] += 1
+                return score, max(depth - plies, 0)
+
+    if ctx.null_move and null_ok and depth > NULL_MOVE_REDUCTION \
+            and (b < inf if maximizing else a > -inf) and may_pass(pos, color):
+        # let the other side move twice: if the score still falls outside the
+        # window, a real move would have done at least as well
+        if maximizing:
+            score, _ = alpha_beta(pos, ~color, for_black, depth - 1 - NULL_MOVE_REDUCTION, b - 1, b, False, ctx, ply + 1, False)
+            if score >= b:
+                ctx.counter['null_cutoffs'] += 1
+                return b, 0
+        else:
+            score, _ = alpha_beta(pos, ~color, for_black, depth - 1 - NULL_MOVE_REDUCTION, a, a + 1, True, ctx, ply + 1, False)
+            if score <= a:
+                ctx.counter['null_cutoffs'] += 1
+                return a, 0
+
+    a_orig, b_orig = a, b
+    best_move = None
     sol_depth = 0
+    # children are only generated as the loop reaches them
+    moves = staged_moves(pos, ctx, color, ply, tt_move)
+    leaves = None
+    if ctx.batch_leaves and depth == 1:
+        moves = list(moves)
+        with ctx.phase('evaluate'):
+            leaves = leaf_scores(pos, moves, for_black)
     if maximizing:
         val = -inf
-        for child in pos.get_children(color):
-            new_val, new_sol_depth = alpha_beta(child, ~color, for_black, depth - 1, a, b, False)
+        for i, (start, end) in enumerate(moves):
+            reduce = ctx.reductions and i >= LMR_FULL_MOVES and depth >= LMR_MIN_DEPTH \
+                and not pos.board[end] and a > -inf
+            pos.make_move(start, end)
+            if leaves is None:
+                new_val = None
+                if reduce:
+                    ctx.counter['reduced'] += 1
+                    new_val, new_sol_depth = alpha_beta(pos, ~color, for_black, depth - 2, a, a + 1, False, ctx, ply + 1)
+                    if new_val > a:
+                        ctx.counter['re_searched'] += 1
+                        new_val = None
+                if new_val is None:
+                    new_val, new_sol_depth = alpha_beta(pos, ~color, for_black, depth - 1, a, b, False, ctx, ply + 1)
+            else:
+                new_val, new_sol_depth = leaf_value(pos, ~color, ctx, for_black, leaves[i], a, b, False), 0
+            pos.unmake_move()
             sol_depth = max(sol_depth, new_sol_depth)
-            val = max(val, new_val)
+            if new_val > val:
+                val = new_val
+                best_move = (start, end)
             if val >= b:
+                record_cutoff(pos, ctx, (start, end), ply, depth, i)
                 break
             if val > a:
                 a = val
-        return val, sol_depth
     else:
         val = inf
-        for child in pos.get_children(color):
-            new_val, new_sol_depth = alpha_beta(child, ~color, for_black, depth - 1, a, b, True)
+        for i, (start, end) in enumerate(moves):
+            reduce = ctx.reductions and i >= LMR_FULL_MOVES and depth >= LMR_MIN_DEPTH \
+                and not pos.board[end] and b < inf
+            pos.make_move(start, end)
+            if leaves is None:
+                new_val = None
+                if reduce:
+                    ctx.counter['reduced'] += 1
+                    new_val, new_sol_depth = alpha_beta(pos, ~color, for_black, depth - 2, b - 1, b, True, ctx, ply + 1)
+                    if new_val < b:
+                        ctx.counter['re_searched'] += 1
+                        new_val = None
+                if new_val is None:
+                    new_val, new_sol_depth = alpha_beta(pos, ~color, for_black, depth - 1, a, b, True, ctx, ply + 1)
+            else:
+                new_val, new_sol_depth = leaf_value(pos, ~color, ctx, for_black, leaves[i], a, b, True), 0
+            pos.unmake_move()
             sol_depth = max(sol_depth, new_sol_depth)
-            val = min(val, new_val)
+            if new_val < val:
+                val = new_val
+                best_move = (start, end)
             if val <= a:
+                record_cutoff(pos, ctx, (start, end), ply, depth, i)
                 break
             if val < b:
                 b = val
-        return val, sol_depth
+
+    if tt is not None:
+        if val <= a_orig:
+            flag = UPPER
+        elif val >= b_orig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        tt.store(key, depth, flag, val, best_move, depth - sol_depth)
+    return val, sol_depth
+
+
+def leaf_scores(pos: Position, moves, black: bool):
+    # every child is a leaf: score them all in one batch. Mates are still
+    # found one child at a time as the loop reaches them.
+    if not moves:
+        return []
+    scores = score_boards(child_boards(board_array(pos), moves))
+    return (-scores if black else scores).tolist()
+
+
+def leaf_value(pos: Position, color: Color, ctx: SearchContext, black: bool, score: int,
+               a: float, b: float, maximizing: bool):
+    ctx.visit()
+    terminal = _terminal(pos)
+    if terminal is not None:
+        return -terminal if black else terminal
+    if ctx.quiescence:
+        return quiescence(pos, color, black, a, b, maximizing, ctx, score)
+    return score
+
+
+def quiescence(pos: Position, color: Color, for_black: bool, a: float, b: float, maximizing: bool,
+               ctx: SearchContext, stand_pat: Optional[float] = None):
+    # captures only, until the position is quiet. The side to move may also
+    # decline to capture, so the static evaluation is a bound to start from.
+    if stand_pat is None:
+        ctx.visit()
+        with ctx.phase('evaluate'):
+            stand_pat = evaluate(pos, for_black)
+        if stand_pat in (inf, -inf):
+            return stand_pat
+    ctx.counter['qnodes'] += 1
+    if maximizing:
+        if stand_pat >= b:
+            return stand_pat
+        a = max(a, stand_pat)
+    else:
+        if stand_pat <= a:
+            return stand_pat
+        b = min(b, stand_pat)
+
+    with ctx.phase('movegen'):
+        moves = pos.get_capture_list(color)
+    with ctx.phase('ordering'):
+        moves = order_captures(pos, moves)
+    board = pos.board
+    val = stand_pat
+    for start, end in moves:
+        # delta pruning: captures come biggest victim first, so once one can't
+        # reach the window none of the rest can either
+        gain = order_value(board[end]) + DELTA_MARGIN
+        if (stand_pat + gain <= a) if maximizing else (stand_pat - gain >= b):
+            ctx.counter['delta_pruned'] += 1
+            break
+        pos.make_move(start, end)
+        new_val = quiescence(pos, ~color, for_black, a, b, not maximizing, ctx)
+        pos.unmake_move()
+        if maximizing:
+            val = max(val, new_val)
+            if val >= b:
+                break
+            a = max(a, val)
+        else:
+            val = min(val, new_val)
+            if val <= a:
+                break
+            b = min(b, val)
+    return val
 
 
 def evaluate(pos: Position, black: bool = False):
@@ -92,39 +390,47 @@ def evaluate(pos: Position, black: bool = False):
 
 #@lru_cache(maxsize=None)
 def _evaluate(pos: Position):
+    terminal = _terminal(pos)
+    if terminal is not None:
+        return terminal
+    return score_pieces(pos)
+
+
+def _terminal(pos: Position):
     # check checks
     
-    white_king = next((p for p in pos.white_pieces if p.type == Chessman.king), None)
+    white_king = pos.kings[Color.white]
     if white_king is None:
         return - inf
-    black_king = next((p for p in pos.black_pieces if p.type == Chessman.king), None)
+    black_king = pos.kings[Color.black]
     if black_king is None:
         return inf
 
-    white_in_check = in_check(pos, white_king)
-    black_in_check = in_check(pos, black_king)
-
-    if len(tuple(white_king.get_moves(pos))) == 0 and white_in_check:
+    # a king with somewhere to go isn't mated, so the attack map is only
+    # needed for kings that are boxed in
+    if len(tuple(pos.get_moves(white_king))) == 0 and in_check(pos, white_king):
         return - inf
-    if len(tuple(black_king.get_moves(pos))) == 0 and black_in_check:
+    if len(tuple(pos.get_moves(black_king))) == 0 and in_check(pos, black_king):
         return inf
 
-    bonus = 0
-
-    return score_pieces(pos) + bonus
+    return None
 
 
 def score_pieces(pos: Position) -> int:
     # TODO scale by number of remaining pieces
-    white_score = sum(p.value for p in pos.white_pieces)
-    black_score = sum(p.value for p in pos.black_pieces)
-    return white_score - black_score
+    return pos.material
+
+
 
+def may_pass(pos: Position, color: Color) -> bool:
+    # passing is only a safe lower bound for a side that isn't in check and
+    # has something other than its king and pawns to move
+    sign = color_sign(color)
+    if not any(abs(code) in SLIDER_DIRECTIONS for code in pos.board if code * sign > 0):
+        return False
+    return not in_check(pos, pos.kings[color])
 
 
-def in_check(position: Position, king: Piece):
-    pieces = position.black_pieces if king.is_white else position.white_pieces
-    for piece in pieces:
-        if king.index in piece.get_moves(position):
-            return True
-    return False
\ No newline at end of file
+def in_check(position: Position, king_idx: int):
+    enemy = Color.black if position.board[king_idx] > 0 else Color.white
+    return position.is_attacked(king_idx, enemy)
\ No newline at end of file
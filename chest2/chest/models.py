@@ -1,14 +1,11 @@
-from enum import Enum
-from typing import List, Tuple, Optional
-from copy import deepcopy
-from dataclasses import dataclass
-from itertools import chain
-from functools import lru_cache
+from array import array
+from enum import Enum, IntEnum
+from typing import Iterable, Iterator, List, Tuple, Optional
 
-from chest.utils import raycast
-
-straight_directions = ((1, 0), (-1, 0), (0, 1), (0, -1))
-diagonal_directions = ((1, 1), (-1, 1), (1, -1), (-1, -1))
+from chest.utils import walk, first_capture
+from chest.geometry import geometry, STRAIGHT_DIRECTIONS as straight_directions, \
+    DIAGONAL_DIRECTIONS as diagonal_directions
+from chest.zobrist import ZOBRIST, board_key, geometry_key
 
 class Color(Enum):
     white = 1
@@ -27,34 +24,61 @@ class Chessman(str, Enum):
     pawn = 'p'
     bishop = 'b'
 
-class Piece:
+class PieceType(IntEnum):
+    pawn = 1
+    knight = 2
+    bishop = 3
+    rook = 4
+    queen = 5
+    king = 6
+
+# A square holds 0 when empty, the PieceType for a white piece and minus
+# the PieceType for a black one. Tables indexed by that code use Python's
+# negative indexing for black, e.g. PIECE_CHARS[-PieceType.rook] == 'r'.
+EMPTY = 0
+PIECE_CHARS = '.PNBRQKkqrbnp'
+CHAR_CODES = {c: i if i <= 6 else i - len(PIECE_CHARS) for i, c in enumerate(PIECE_CHARS) if c != '.'}
+PIECE_VALUES = (0, 1, 3, 3, 5, 9, 0)
+SIGNED_VALUES = PIECE_VALUES + tuple(-v for v in reversed(PIECE_VALUES[1:]))
+ZOBRIST_BY_CODE = [ZOBRIST.get(c) for c in PIECE_CHARS]
+
+SLIDER_DIRECTIONS = {
+    PieceType.queen: straight_directions + diagonal_directions,
+    PieceType.rook: straight_directions,
+    PieceType.bishop: diagonal_directions,
+}
+
 
-    value = 0
+def color_sign(color: Color) -> int:
+    return 1 if color is Color.white else -1
+
+
+class Piece:
+    # A piece on a square, for callers that want an object. Boards only
+    # store codes, so these are built on request and never by the search.
+    __slots__ = ('color', 'type', 'index')
 
     @classmethod
     def from_char(cls, c: str, idx: int) -> 'Piece':
-        color = Color.black
-        if c.isupper():
-            color = Color.white
-        type = c.lower()
-        if type == Chessman.king:
-            return King(color, type, idx)
-        elif type == Chessman.queen:
-            return Queen(color, type, idx)
-        elif type == Chessman.rook:
-            return Rook(color, type, idx)
-        elif type == Chessman.bishop:
-            return Bishop(color, type, idx)
-        elif type == Chessman.knight:
-            return Knight(color, type, idx)
-        elif type == Chessman.pawn:
-            return Pawn(color, type, idx)
+        return cls.from_code(CHAR_CODES[c], idx)
+
+    @classmethod
+    def from_code(cls, code: int, idx: int) -> 'Piece':
+        return cls(Color.white if code > 0 else Color.black, Chessman(PIECE_CHARS[-abs(code)]), idx)
 
     def __init__(self, color: Color, type: Chessman, index: int):
         self.color = color
         self.type = type
         self.index = index
 
+    @property
+    def code(self) -> int:
+        return CHAR_CODES[str(self)]
+
+    @property
+    def value(self) -> int:
+        return PIECE_VALUES[abs(self.code)]
+
     @property
     def is_white(self):
         return self.color == Color.white
@@ -62,74 +86,66 @@ class Piece:
     def move(self, index: int) -> 'Piece':
         return self.__class__(self.color, self.type, index)
 
-    def get_moves(self, pos: 'Position'):
-        raise NotImplementedError
-
     def __str__(self):
         if self.color == Color.white:
             return self.type.upper()
         return self.type
-    
-    def __hash__(self):
-        return hash(str(self) + str(self.index))
-
-class King(Piece):
-    def get_moves(self, pos: 'Position'):
-        return chain(*(raycast(pos, self.index, v, self.color, limit=1) for v in straight_directions + diagonal_directions))
-
-class Queen(Piece):
-    value = 9
-    def get_moves(self, pos: 'Position'):
-        return chain(*(raycast(pos, self.index, v, self.color) for v in straight_directions + diagonal_directions))
-
-class Rook(Piece):
-    value = 5
-    def get_moves(self, pos: 'Position'):
-        return chain(*(raycast(pos, self.index, v, self.color) for v in straight_directions))
-
-class Bishop(Piece):
-    value = 3
-    def get_moves(self, pos: 'Position'):
-        return chain(*(raycast(pos, self.index, v, self.color) for v in diagonal_directions))
-
-class Knight(Piece):
-    value = 3
-    def get_moves(self, pos: 'Position'):
-        return ()
 
+    def __eq__(self, other):
+        return isinstance(other, Piece) and (self.code, self.index) == (other.code, other.index)
 
-class Pawn(Piece):
-    value = 1
-    def get_moves(self, pos: 'Position'):
-        if self.color == Color.white:
-            starting_pos = self.index <= 55 and self.index >= 48
-            direction = (0, -1)
-        else:
-            starting_pos = self.index <= 15 and self.index >= 8
-            direction = (0, 1)
-        limit = 2 if starting_pos else 1
-        return raycast(pos, self.index, direction, self.color, limit=limit, allow_capture=False)
+    def __hash__(self):
+        return hash((self.code, self.index))
 
 class Position:
-    def __init__(self, height: int, width: int, board: List[Optional[Piece]]):
+    __slots__ = ('board_height', 'board_width', 'geometry', 'board', 'material', 'kings', 'key', 'history',
+                 '_attacks_key', '_attacks')
+
+    def __init__(self, height: int, width: int, board: Iterable[int]):
         self.board_height = height 
         self.board_width = width
-        self.board = board
+        self.geometry = geometry(width, height)
+        self.board = array('b', board)
+        # kept up to date by make_move/unmake_move instead of being rescanned
+        self.material = sum(SIGNED_VALUES[code] for code in self.board)
+        self.kings = {c: None for c in Color}
+        for idx, code in enumerate(self.board):
+            if code == PieceType.king:
+                self.kings[Color.white] = idx
+            elif code == -PieceType.king:
+                self.kings[Color.black] = idx
+        self.key = board_key(PIECE_CHARS[code] if code else None for code in self.board) ^ geometry_key(width, height)
+        self.history = []
+        # attack maps of the position with key _attacks_key, built on demand
+        self._attacks_key = None
+        self._attacks = {}
+
+    def pieces(self, color: Color) -> Iterator[int]:
+        sign = color_sign(color)
+        return (idx for idx, code in enumerate(self.board) if code * sign > 0)
+
+    def piece_at(self, index: int) -> Optional[Piece]:
+        code = self.board[index]
+        return Piece.from_code(code, index) if code else None
 
     @property
     def white_pieces(self):
-        return (p for p in self.board if p is not None and p.is_white)
+        return (Piece.from_code(self.board[idx], idx) for idx in self.pieces(Color.white))
 
     @property
     def black_pieces(self):
-        return (p for p in self.board if p is not None and not p.is_white)
+        return (Piece.from_code(self.board[idx], idx) for idx in self.pieces(Color.black))
 
     def __hash__(self):
-        return hash(''.join(str(s) for s in self.board))
+        return self.key
+
+    def to_array(self):
+        from chest.vector import board_array
+        return board_array(self)
 
     @classmethod
-    def from_fen(self, fen: str) -> 'Position':
-        position = Position(8, 8, [None for _ in range(8*8)])
+    def from_fen(cls, fen: str) -> 'Position':
+        board = [EMPTY for _ in range(8*8)]
         rows = fen.split('/')
         row_idx = 0
         for row in rows:
@@ -138,11 +154,10 @@ class Position:
                 if c.isnumeric():
                     column += int(c) - 1
                 else:
-                    idx = position.board_width * row_idx + column
-                    position.board[idx] = Piece.from_char(c, idx)
+                    board[8 * row_idx + column] = CHAR_CODES[c]
                 column += 1
             row_idx += 1
-        return position
+        return cls(8, 8, board)
         
     def to_fen(self) -> str:
         output = ''
@@ -153,31 +168,137 @@ class Position:
                     output += str(empties)
                     empties = 0
                 output += '/'
-            if square is None:
+            if square == EMPTY:
                 empties += 1
             else:
                 if empties > 0:
                     output += str(empties)
                     empties = 0
-                output += str(square)
+                output += PIECE_CHARS[square]
         if empties > 0:
             output += str(empties)
         return output
 
-    def perform_move(self, piece: Piece, end: int):
-        new_board = deepcopy(self.board)
-        new_piece = piece.move(end)
+    def copy(self) -> 'Position':
+        position = self.__class__.__new__(self.__class__)
+        position.board_height = self.board_height
+        position.board_width = self.board_width
+        position.geometry = self.geometry
+        position.board = self.board.__copy__()
+        position.material = self.material
+        position.kings = self.kings.copy()
+        position.key = self.key
+        position.history = []
+        # same key, same board: the maps can be shared until either side moves
+        position._attacks_key = self._attacks_key
+        position._attacks = self._attacks
+        return position
+
+    def perform_move(self, start: int, end: int):
+        position = self.copy()
+        position.make_move(start, end)
+        return position
+
+    def make_move(self, start: int, end: int):
+        board = self.board
+        piece = board[start]
+        captured = board[end]
+        board[end] = piece
+        board[start] = EMPTY
+        if piece == PieceType.king or piece == -PieceType.king:
+            self.kings[Color.white if piece > 0 else Color.black] = end
+        keys = ZOBRIST_BY_CODE[piece]
+        self.key ^= keys[start] ^ keys[end]
+        if captured:
+            self.material -= SIGNED_VALUES[captured]
+            if captured == PieceType.king or captured == -PieceType.king:
+                self.kings[Color.white if captured > 0 else Color.black] = None
+            self.key ^= ZOBRIST_BY_CODE[captured][end]
+        self.history.append((start, end, piece, captured))
+
+    def unmake_move(self):
+        start, end, piece, captured = self.history.pop()
+        board = self.board
+        board[start] = piece
+        board[end] = captured
+        if piece == PieceType.king or piece == -PieceType.king:
+            self.kings[Color.white if piece > 0 else Color.black] = start
+        keys = ZOBRIST_BY_CODE[piece]
+        self.key ^= keys[start] ^ keys[end]
+        if captured:
+            self.material += SIGNED_VALUES[captured]
+            if captured == PieceType.king or captured == -PieceType.king:
+                self.kings[Color.white if captured > 0 else Color.black] = end
+            self.key ^= ZOBRIST_BY_CODE[captured][end]
+
+    def get_move_list(self, color: Color) -> List[Tuple[int, int]]:
+        return [(idx, move) for idx in self.pieces(color) for move in self.get_moves(idx)]
+
+    def get_moves(self, index: int) -> Tuple[int, ...]:
+        board = self.board
+        code = board[index]
+        kind = abs(code)
+        if kind == PieceType.king:
+            # empty squares and enemies: anything not of the king's own sign
+            return tuple(s for s in self.geometry.king_steps[index] if board[s] * code <= 0)
+        if kind in SLIDER_DIRECTIONS:
+            rays = self.geometry.rays
+            moves = []
+            for direction in SLIDER_DIRECTIONS[kind]:
+                moves += walk(board, rays[direction][index], code)
+            return tuple(moves)
+        if kind == PieceType.pawn:
+            moves = []
+            for square in self.geometry.pawn_pushes[-1 if code > 0 else 1][index]:
+                if board[square]:
+                    break
+                moves.append(square)
+            return tuple(moves)
+        # knights don't move yet
+        return ()
+
+    def get_captures(self, index: int) -> Tuple[int, ...]:
+        # the moves of get_moves that take a piece; pawns only push
+        board = self.board
+        code = board[index]
+        kind = abs(code)
+        if kind == PieceType.king:
+            return tuple(s for s in self.geometry.king_steps[index] if board[s] * code < 0)
+        if kind in SLIDER_DIRECTIONS:
+            rays = self.geometry.rays
+            return tuple(s for direction in SLIDER_DIRECTIONS[kind]
+                         for s in first_capture(board, rays[direction][index], code))
+        return ()
+
+    def get_capture_list(self, color: Color) -> List[Tuple[int, int]]:
+        return [(idx, move) for idx in self.pieces(color) for move in self.get_captures(idx)]
+
+    def attacks(self, color: Color) -> int:
+        # bitmask of every square color's pieces can move to. Computed once
+        # per position and dropped as soon as a move changes the key.
+        if self._attacks_key != self.key:
+            self._attacks_key = self.key
+            self._attacks = {}
+        mask = self._attacks.get(color)
+        if mask is None:
+            mask = self._attacks[color] = self._attack_map(color)
+        return mask
 
-        new_board[end] = new_piece
-        new_board[piece.index] = None
+    def _attack_map(self, color: Color) -> int:
+        mask = 0
+        for idx in self.pieces(color):
+            for move in self.get_moves(idx):
+                mask |= 1 << move
+        return mask
 
-        return Position(self.board_height, self.board_width, new_board)
+    def is_attacked(self, index: int, color: Color) -> bool:
+        return self.attacks(color) >> index & 1 == 1
 
     def get_children(self, color: Color):
-        for piece in (p for p in self.board if p is not None and p.color == color):
-            moves = piece.get_moves(self)
-            for move in moves:
-                yield self.perform_move(piece, move)
+        # generated and copied a move at a time, so a caller that stops early skips the rest
+        for start in self.pieces(color):
+            for end in self.get_moves(start):
+                yield self.perform_move(start, end)
     
     def __str__(self):
-        return self.to_fen()
\ No newline at end of file
+        return self.to_fen()
@@ -0,0 +1,110 @@
+from typing import Iterator, List, Optional, Tuple
+
+from chest.models import Position, Color, PieceType, PIECE_VALUES, color_sign
+from chest.search import SearchContext
+
+HASH_SCORE = 1 << 60
+CAPTURE_SCORE = 1 << 50
+KILLER_SCORE = 1 << 40
+KILLERS_PER_PLY = 2
+
+# kings are worth 0 in the evaluation, but taking one ends the game
+KING_VALUE = 100
+ORDER_VALUES = PIECE_VALUES[:PieceType.king] + (KING_VALUE,)
+
+
+def order_value(code: int) -> int:
+    return ORDER_VALUES[abs(code)]
+
+
+def order_moves(pos: Position, moves: List[Tuple[int, int]], ctx: SearchContext, ply: int,
+                hash_move: Optional[Tuple[int, int]] = None) -> List[Tuple[int, int]]:
+    if not ctx.ordering:
+        return moves
+    pv_move = ctx.pv_move(ply)
+    killers = ctx.killers.get(ply, ())
+    history = ctx.history
+    board = pos.board
+
+    def score(move):
+        if move == hash_move:
+            return HASH_SCORE + 1
+        if move == pv_move:
+            return HASH_SCORE
+        victim = board[move[1]]
+        if victim:
+            # MVV-LVA: most valuable victim first, cheapest attacker breaks ties
+            return CAPTURE_SCORE + 16 * order_value(victim) - order_value(board[move[0]])
+        if move in killers:
+            return KILLER_SCORE - killers.index(move)
+        # keep quiet root moves in generation order, so that which of several
+        # equal moves gets picked doesn't depend on what the search learned
+        # (and serial and parallel root searches agree)
+        return history[move] if ply else 0
+
+    return sorted(moves, key=score, reverse=True)
+
+
+def staged_moves(pos: Position, ctx: SearchContext, color: Color, ply: int,
+                 hash_move: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[int, int]]:
+    # The moves in order_moves' order, generated a stage at a time: the hash
+    # and pv moves, then captures, then quiet moves. A cutoff stops the
+    # generator, so whatever stages are left are never generated or sorted.
+    if not ctx.ordering:
+        with ctx.phase('movegen'):
+            moves = pos.get_move_list(color)
+        yield from moves
+        return
+    board = pos.board
+    sign = color_sign(color)
+    tried = []
+    for move in (hash_move, ctx.pv_move(ply)):
+        # either can be stale, or another position's after a key collision
+        if move is not None and move not in tried and board[move[0]] * sign > 0 \
+                and move[1] in pos.get_moves(move[0]):
+            tried.append(move)
+            yield move
+
+    with ctx.phase('movegen'):
+        captures = pos.get_capture_list(color)
+    with ctx.phase('ordering'):
+        captures = order_captures(pos, captures)
+    for move in captures:
+        if move not in tried:
+            yield move
+
+    with ctx.phase('movegen'):
+        quiet = [(idx, move) for idx in pos.pieces(color) for move in pos.get_moves(idx) if not board[move]]
+    with ctx.phase('ordering'):
+        killers = ctx.killers.get(ply, ())
+        history = ctx.history
+
+        def score(move):
+            if move in killers:
+                return KILLER_SCORE - killers.index(move)
+            return history[move] if ply else 0
+
+        quiet.sort(key=score, reverse=True)
+    for move in quiet:
+        if move not in tried:
+            yield move
+
+
+def record_cutoff(pos: Position, ctx: SearchContext, move: Tuple[int, int], ply: int, depth: int, index: int):
+    ctx.counter['cutoffs'] += 1
+    if index == 0:
+        ctx.counter['first_move_cutoffs'] += 1
+    if pos.board[move[1]]:
+        return
+    killers = ctx.killers.setdefault(ply, [])
+    if move not in killers:
+        killers.insert(0, move)
+        del killers[KILLERS_PER_PLY:]
+    ctx.history[move] += depth * depth
+
+
+def order_captures(pos: Position, moves: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # MVV-LVA alone: quiescence only sees captures and has no hash move to try
+    board = pos.board
+    return sorted(moves, key=lambda move: 16 * order_value(board[move[1]]) - order_value(board[move[0]]),
+                  reverse=True)
@@ -0,0 +1,111 @@
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from math import inf
+from multiprocessing import Value
+from typing import Dict, List, Optional, Tuple, Type
+
+from chest.models import Position, Color
+from chest.evaluate import alpha_beta, root_moves
+from chest.search import SearchContext, SearchStats, SearchTimeout
+from chest.transposition import TranspositionTable, EXACT, LOWER, UPPER, DEFAULT_SIZE_MB
+
+# search_root prefers the faster solution among equally scored moves, which
+# needs every root move's exact score and solution depth, so unlike chest
+# there is no alpha shared between workers: each root move gets a full window.
+
+# nodes left of the current root's budget, claimed by the workers as they search
+_budget = None
+_ctx: Optional[SearchContext] = None
+
+# the caller's search settings, applied to a worker's context for each task
+SETTINGS = ('ordering', 'batch_leaves', 'quiescence', 'null_move', 'reductions', 'aspiration')
+
+
+def _init_worker(budget, tt_mb: float):
+    global _budget, _ctx
+    _budget = budget
+    _ctx = SearchContext(tt=TranspositionTable(tt_mb))
+
+
+def _search_move(cls: Type[Position], height: int, width: int, board: array, color: Color, move: Tuple[int, int], depth: int, a: float, b: float,
+                 pv: List[Tuple[int, int]], deadline: Optional[float], limited: bool,
+                 settings: Dict[str, bool], stats: bool):
+    ctx = _ctx
+    for name, value in settings.items():
+        setattr(ctx, name, value)
+    # counted afresh for each move and sent back to be merged into the caller's
+    ctx.counter = Counter()
+    ctx.stats = SearchStats() if stats else None
+    ctx.pv = pv
+    ctx.deadline = deadline
+    nodes = ctx.nodes
+    if limited:
+        ctx.shared_budget, ctx.node_limit = _budget, nodes
+    pos = cls(height, width, board)
+    pos.make_move(*move)
+    try:
+        score, child_depth = alpha_beta(pos, ~color, color == Color.black, depth, a, b, maximizing=False, ctx=ctx)
+    except SearchTimeout:
+        return None
+    finally:
+        ctx.deadline = None
+        if limited:
+            ctx.release_nodes()
+    return score, child_depth, ctx.nodes - nodes, ctx.counter, ctx.stats
+
+
+class RootSplitter:
+    def __init__(self, workers: int, tt_mb: float = DEFAULT_SIZE_MB):
+        self.budget = Value('q', 0)
+        self.pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.budget, tt_mb / workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def search(self, pos: Position, color: Color, depth: int, ctx: SearchContext, a: float = -inf, b: float = inf):
+        # same contract as search_root: (score, move, solution depth)
+        root_key, moves = root_moves(pos, color, ctx)
+        self.budget.value = max(ctx.node_limit - ctx.nodes, 0) if ctx.node_limit is not None else 0
+        settings = {name: getattr(ctx, name) for name in SETTINGS}
+        # the board goes as its bytes, and each worker builds its own position from them
+        futures = [self.pool.submit(_search_move, type(pos), pos.board_height, pos.board_width, pos.board, color,
+                                    move, depth, a, b, ctx.pv, ctx.deadline, ctx.node_limit is not None, settings,
+                                    ctx.stats is not None)
+                   for move in moves]
+
+        best_score = -inf
+        best_depth = 0
+        best_move = None
+        try:
+            for move, future in zip(moves, futures):
+                result = future.result()
+                if result is None:
+                    raise SearchTimeout()
+                score, child_depth, nodes, counter, stats = result
+                ctx.nodes += nodes
+                ctx.merge(counter, stats)
+                if ctx.node_limit is not None and ctx.nodes > ctx.node_limit:
+                    raise SearchTimeout()
+                if score > best_score:
+                    best_move = move
+                    best_score = score
+                elif score == best_score and child_depth >= best_depth:
+                    best_depth = child_depth
+                    best_move = move
+                    best_score = score
+        except SearchTimeout:
+            for future in futures:
+                future.cancel()
+            raise
+
+        if best_move is not None:
+            flag = UPPER if best_score <= a else LOWER if best_score >= b else EXACT
+            ctx.tt.store(root_key, depth + 1, flag, best_score, best_move)
+        return best_score, best_move, best_depth
@@ -0,0 +1,101 @@
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+from chest.models import Position, Color
+from chest.bitboard import BitboardPosition
+from chest.utils import move_name
+
+SUITE = Path(__file__).with_name('perft_suite.json')
+BACKENDS = {'mailbox': Position, 'bitboard': BitboardPosition}
+
+
+def perft(pos: Position, color: Color, depth: int) -> int:
+    if depth == 0:
+        return 1
+    return sum(perft(child, ~color, depth - 1) for child in pos.get_children(color))
+
+
+def divide(pos: Position, color: Color, depth: int):
+    for start, end in pos.get_move_list(color):
+        yield (start, end), perft(pos.perform_move(start, end), ~color, depth - 1)
+
+
+def timed(func, *args):
+    now = perf_counter()
+    result = func(*args)
+    return result, perf_counter() - now
+
+
+def report(nodes: int, seconds: float) -> str:
+    return f"{nodes} nodes in {seconds:.3f}s ({nodes / max(seconds, 1e-9):.0f} nps)"
+
+
+def compare_backends(fen: str, color: Color, depth: int):
+    results = []
+    for name, backend in BACKENDS.items():
+        nodes, seconds = timed(perft, backend.from_fen(fen), color, depth)
+        print(f"{name}: {report(nodes, seconds)}")
+        results.append(nodes)
+    if len(set(results)) != 1:
+        raise AssertionError(f"backends disagree on {fen} at depth {depth}: {results}")
+    return results[0]
+
+
+def run_suite(backend, record: bool = False) -> bool:
+    suite = json.loads(SUITE.read_text())
+    ok = True
+    for case in suite:
+        color = Color[case['color']]
+        nodes, seconds = timed(perft, backend.from_fen(case['fen']), color, case['depth'])
+        status = 'ok' if nodes == case['nodes'] else f"FAIL (expected {case['nodes']})"
+        ok &= nodes == case['nodes']
+        print(f"{case['fen']} {case['color']} depth {case['depth']}: {report(nodes, seconds)}"
+              f" [reference {case['seconds']:.3f}s] {status}")
+        if record:
+            case.update(nodes=nodes, seconds=round(seconds, 3))
+    if record:
+        SUITE.write_text(json.dumps(suite, indent=2) + '\n')
+    return ok
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m chest.perft', description='count leaf nodes of get_children to a fixed depth')
+    parser.add_argument('fen', nargs='?')
+    parser.add_argument('depth', nargs='?', type=int, default=3)
+    parser.add_argument('--color', choices=[c.name for c in Color], default='white')
+    parser.add_argument('--backend', choices=BACKENDS, default='bitboard')
+    parser.add_argument('--divide', action='store_true', help='print the node count below each root move')
+    parser.add_argument('--compare', action='store_true', help='run every backend and check they agree')
+    parser.add_argument('--suite', action='store_true', help=f'run the reference positions in {SUITE.name}')
+    parser.add_argument('--record', action='store_true', help='with --suite, store the measured counts and timings')
+    args = parser.parse_args(argv)
+    backend = BACKENDS[args.backend]
+
+    if args.suite:
+        return 0 if run_suite(backend, args.record) else 1
+    if args.fen is None:
+        parser.error('a FEN is required unless --suite is given')
+
+    color = Color[args.color]
+    if args.compare:
+        compare_backends(args.fen, color, args.depth)
+        return 0
+
+    pos = backend.from_fen(args.fen)
+    now = perf_counter()
+    if args.divide:
+        nodes = 0
+        for move, count in divide(pos, color, args.depth):
+            print(f"{move_name(pos, move)}: {count}")
+            nodes += count
+    else:
+        nodes = perft(pos, color, args.depth)
+    print(report(nodes, perf_counter() - now))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+from typing import List, Optional, Tuple
+
+from chest.models import Position, Color, color_sign
+from chest.book import Book
+from chest.evaluate import iterative_deepening
+from chest.search import SearchContext, IterationInfo
+from chest.transposition import TranspositionTable, DEFAULT_SIZE_MB
+
+
+class GameSession:
+    # One game, searched move after move with the same transposition table,
+    # killers and history, so each search starts from what the last ones
+    # found instead of from nothing. Moves are played on the session's own
+    # copy of the position, whichever side makes them. While the game is in
+    # the book, if there is one, its moves are played without a search.
+    def __init__(self, pos: Position, color: Color = Color.white, tt_mb: float = DEFAULT_SIZE_MB,
+                 book: Optional[Book] = None):
+        self.pos = pos.copy()
+        self.color = color
+        self.ctx = SearchContext(tt=TranspositionTable(tt_mb))
+        self.book = book
+        # what the last search expects from here on, trimmed as moves are played
+        self.pv: List[Tuple[int, int]] = []
+        self.moves: List[Tuple[int, int]] = []
+
+    def search(self, max_depth: int = 3, time_limit: Optional[float] = None, node_limit: Optional[int] = None,
+               on_iteration=None) -> Tuple[Optional[Tuple[int, int]], float, List[IterationInfo]]:
+        move = self.book.choose(self.pos, self.color) if self.book is not None else None
+        if move is not None:
+            self.pv = [move]
+            return move, 0, []
+        ctx = self.ctx
+        # older history counts for less, so the table follows the game
+        for move in ctx.history:
+            ctx.history[move] //= 2
+        move, score, iterations = iterative_deepening(self.pos, self.color, max_depth, time_limit, node_limit,
+                                                      ctx, on_iteration, pv=self.pv)
+        self.pv = list(ctx.pv) if ctx.pv[:1] == [move] else [move] if move is not None else []
+        return move, score, iterations
+
+    def play(self, start: int, end: int):
+        if self.pos.board[start] * color_sign(self.color) <= 0 or end not in self.pos.get_moves(start):
+            raise ValueError(f"illegal move {(start, end)} for {self.color.name}")
+        self.pos.make_move(start, end)
+        self.moves.append((start, end))
+        self.color = ~self.color
+        self.pv = self.pv[1:] if self.pv[:1] == [(start, end)] else []
+        # killers are kept by distance from the root, which is now a ply closer
+        self.ctx.killers = {ply - 1: killers for ply, killers in self.ctx.killers.items() if ply > 0}
+
+    def think(self, max_depth: int = 3, time_limit: Optional[float] = None, node_limit: Optional[int] = None,
+              on_iteration=None) -> Tuple[Optional[Tuple[int, int]], float]:
+        # search and play the move found
+        move, score, _ = self.search(max_depth, time_limit, node_limit, on_iteration)
+        if move is not None:
+            self.play(*move)
+        return move, score
@@ -0,0 +1,74 @@
+from array import array
+from typing import Optional, Tuple
+
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+# Moves are kept as one 16-bit word, a byte for each square, so boards can
+# have at most MAX_SQUARES squares; square 255 is never on a board, which
+# leaves NO_MOVE free to mean "no move".
+MAX_SQUARES = 255
+NO_MOVE = 0xFFFF
+# key, score, move, depth, flag, generation, plies
+ENTRY_BYTES = 8 + 8 + 2 + 1 + 1 + 1 + 1
+
+DEFAULT_SIZE_MB = 64
+
+
+def encode_move(move: Optional[Tuple[int, int]]) -> int:
+    if move is None:
+        return NO_MOVE
+    start, end = move
+    if not (0 <= start < MAX_SQUARES and 0 <= end < MAX_SQUARES):
+        raise ValueError(f"move {move} is off a board of at most {MAX_SQUARES} squares")
+    return start << 8 | end
+
+
+def decode_move(move: int) -> Optional[Tuple[int, int]]:
+    if move == NO_MOVE:
+        return None
+    return move >> 8, move & 0xFF
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: float = DEFAULT_SIZE_MB):
+        self.size = max(1, int(size_mb * 2**20) // ENTRY_BYTES)
+        self.keys = array('Q', bytes(8 * self.size))
+        self.scores = array('d', bytes(8 * self.size))
+        self.moves = array('H', bytes(2 * self.size))
+        self.depths = array('B', bytes(self.size))
+        self.flags = array('B', bytes(self.size))
+        self.generations = array('B', bytes(self.size))
+        # how far below the node alpha_beta's solution depth was found
+        self.plies = array('B', bytes(self.size))
+        self.generation = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) % 256
+
+    def clear(self):
+        for table in (self.keys, self.scores, self.moves, self.depths, self.flags, self.generations, self.plies):
+            table[:] = array(table.typecode, bytes(table.itemsize * self.size))
+
+    def probe(self, key: int):
+        slot = key % self.size
+        if self.flags[slot] == 0 or self.keys[slot] != key:
+            return None
+        return self.depths[slot], self.flags[slot], self.scores[slot], decode_move(self.moves[slot]), self.plies[slot]
+
+    def store(self, key: int, depth: int, flag: int, score: float, move: Optional[Tuple[int, int]], plies: int = 0):
+        slot = key % self.size
+        # depth-preferred, but anything left over from an earlier search can go
+        if self.flags[slot] != 0 and self.keys[slot] != key \
+                and self.generations[slot] == self.generation and self.depths[slot] > depth:
+            return
+        if self.keys[slot] == key and move is None:
+            move = decode_move(self.moves[slot])
+        self.keys[slot] = key
+        self.scores[slot] = score
+        self.moves[slot] = encode_move(move)
+        self.depths[slot] = min(depth, 255)
+        self.flags[slot] = flag
+        self.generations[slot] = self.generation
+        self.plies[slot] = min(plies, 255)
@@ -0,0 +1,261 @@
+import re
+import sys
+import threading
+from math import inf
+from time import monotonic
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from chest.models import Position, Color
+from chest.book import Book
+from chest.evaluate import iterative_deepening
+from chest.perft import BACKENDS
+from chest.search import SearchContext, IterationInfo
+from chest.transposition import TranspositionTable, DEFAULT_SIZE_MB
+from chest.utils import move_name
+
+NAME = 'chest2'
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR'
+MAX_DEPTH = 64
+# with only a clock to go by, spend this share of what's left plus most of
+# the increment, and keep a little back for the GUI's own overhead
+MOVES_TO_GO = 30
+OVERHEAD = 0.05
+
+MOVE = re.compile(r'([a-z])(\d+)([a-z])(\d+)')
+GO_PARAMS = {'depth', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo', 'nodes'}
+
+
+def parse_move(pos: Position, color: Color, name: str) -> Tuple[int, int]:
+    match = MOVE.fullmatch(name[:4]) or MOVE.fullmatch(name)
+    if match is None:
+        raise ValueError(f"bad move {name!r}")
+    f1, r1, f2, r2 = match.groups()
+    move = tuple(pos.board_width * (pos.board_height - int(rank)) + ord(file) - 97
+                 for file, rank in ((f1, r1), (f2, r2)))
+    if move not in pos.get_move_list(color):
+        raise ValueError(f"illegal move {name!r}")
+    return move
+
+
+def format_score(score: float, pv: List[Tuple[int, int]]) -> str:
+    # scores are pawns for the side to move; a mate's distance is the length
+    # of the line that gets there
+    if score in (inf, -inf):
+        moves = max(1, (len(pv) + 1) // 2)
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {round(score * 100)}"
+
+
+def think_time(params: Dict[str, int], color: Color) -> float:
+    if 'movetime' in params:
+        return max(params['movetime'] / 1000 - OVERHEAD, 0.01)
+    black = color == Color.black
+    clock = params.get('btime' if black else 'wtime')
+    if clock is None:
+        return inf
+    increment = params.get('binc' if black else 'winc', 0)
+    budget = (clock / params.get('movestogo', MOVES_TO_GO) + 0.75 * increment) / 1000
+    return max(min(budget, clock / 2000) - OVERHEAD, 0.01)
+
+
+class Engine:
+    # Commands are read on the calling thread and searches run on a worker
+    # thread, so stop and ponderhit are seen while the engine is thinking.
+    def __init__(self, out: TextIO = sys.stdout):
+        self.out = out
+        self.lock = threading.Lock()
+        self.ctx = SearchContext(tt=TranspositionTable())
+        self.book: Optional[Book] = None
+        self.backend = BACKENDS['bitboard']
+        self.pos = self.backend.from_fen(START_FEN)
+        self.color = Color.white
+        self.thread: Optional[threading.Thread] = None
+        self.timer: Optional[threading.Timer] = None
+        # infinite and ponder searches wait for this before answering
+        self.release = threading.Event()
+        self.hold = False
+        self.budget = inf
+
+    def send(self, line: str):
+        with self.lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def handle(self, line: str) -> bool:
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send(f"id name {NAME}")
+            self.send("id author chest")
+            self.send(f"option name Hash type spin default {DEFAULT_SIZE_MB} min 1 max 4096")
+            self.send("option name Ponder type check default false")
+            self.send(f"option name Backend type combo default bitboard {' '.join('var ' + b for b in BACKENDS)}")
+            self.send("option name Book type string default <empty>")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.set_option(args)
+        elif command == 'ucinewgame':
+            self.stop()
+            self.ctx.tt.clear()
+            self.ctx.killers.clear()
+            self.ctx.history.clear()
+        elif command == 'position':
+            self.stop()
+            self.set_position(args)
+        elif command == 'go':
+            self.stop()
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'd' and self.pos is not None:
+            self.send(f"{self.pos.to_fen()} {'b' if self.color == Color.black else 'w'}")
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, args: List[str]):
+        text = ' '.join(args)
+        match = re.fullmatch(r'name (.+?)(?: value (.*))?', text)
+        if match is None:
+            return
+        name, value = match.group(1).lower(), match.group(2)
+        self.stop()
+        try:
+            if name == 'hash':
+                self.ctx.tt = TranspositionTable(float(value))
+            elif name == 'backend':
+                self.backend = BACKENDS[value]
+                if self.pos is not None:
+                    self.pos = self.backend.from_fen(self.pos.to_fen())
+            elif name == 'book':
+                if self.book is not None:
+                    self.book.close()
+                self.book = Book(value) if value and value != '<empty>' else None
+        except (KeyError, OSError, ValueError) as e:
+            self.send(f"info string {e}")
+
+    def set_position(self, args: List[str]):
+        if 'moves' in args:
+            split = args.index('moves')
+            setup, moves = args[:split], args[split + 1:]
+        else:
+            setup, moves = args, []
+        try:
+            if setup[:1] == ['startpos']:
+                pos, color = self.backend.from_fen(START_FEN), Color.white
+            elif setup[:1] == ['fen'] and len(setup) > 1:
+                pos = self.backend.from_fen(setup[1])
+                color = Color.black if setup[2:3] == ['b'] else Color.white
+            else:
+                raise ValueError(f"bad position {' '.join(args)!r}")
+            for name in moves:
+                pos.make_move(*parse_move(pos, color, name))
+                color = ~color
+        except (ValueError, IndexError, KeyError) as e:
+            # searching whatever was set before would answer for the wrong position
+            self.send(f"info string {e}")
+            self.pos = None
+            return
+        # the search only needs the board, not how it came about
+        self.pos, self.color = self.backend.from_fen(pos.to_fen()), color
+
+    def go(self, args: List[str]):
+        if self.pos is None:
+            self.send("info string no valid position")
+            self.send("bestmove 0000")
+            return
+        params = {}
+        for name, value in zip(args, args[1:]):
+            if name in GO_PARAMS:
+                params[name] = int(value)
+        ponder, infinite = 'ponder' in args, 'infinite' in args
+        self.budget = think_time(params, self.color)
+        # a deadline is always set so that stop can end the search
+        time_limit = inf if ponder or infinite else self.budget
+        self.hold = ponder or infinite
+        self.release.clear()
+        self.ctx.stopped = False
+        self.thread = threading.Thread(
+            target=self.search, args=(self.pos, self.color, max(params.get('depth', MAX_DEPTH), 1) - 1, time_limit,
+                                      params.get('nodes')), daemon=True)
+        self.thread.start()
+
+    def search(self, pos: Position, color: Color, depth: int, time_limit: float, node_limit: Optional[int]):
+        ctx = self.ctx
+        start, nodes = monotonic(), ctx.nodes
+
+        def info(iteration: IterationInfo):
+            seconds = monotonic() - start
+            searched = ctx.nodes - nodes
+            # the first iteration, depth 0, already looks one move ahead
+            self.send(f"info depth {iteration.depth + 1} score {format_score(iteration.score, iteration.pv)} "
+                      f"nodes {searched} nps {round(searched / seconds) if seconds > 0 else 0} "
+                      f"time {round(seconds * 1000)} pv {' '.join(move_name(pos, m) for m in iteration.pv)}")
+
+        move = self.book.choose(pos, color) if self.book is not None else None
+        if move is not None:
+            self.send(f"info string book move {move_name(pos, move)}")
+            pv = [move]
+        else:
+            move, _, _ = iterative_deepening(pos, color, depth, time_limit, node_limit, ctx, info)
+            pv = ctx.pv
+        moves = pos.get_move_list(color)
+        if move not in moves:
+            # lost anyway: any legal move will do
+            move, pv = (moves[0] if moves else None), []
+        if self.hold:
+            # the GUI says when an infinite or ponder search is over
+            self.release.wait()
+        if move is None:
+            self.send("bestmove 0000")
+        elif len(pv) > 1 and pv[0] == move:
+            self.send(f"bestmove {move_name(pos, move)} ponder {move_name(pos, pv[1])}")
+        else:
+            self.send(f"bestmove {move_name(pos, move)}")
+
+    def ponderhit(self):
+        # the expected move was played: think for as long as a normal search would
+        if self.thread is None or not self.hold:
+            return
+        self.hold = False
+        self.release.set()
+        if self.budget < inf:
+            self.timer = threading.Timer(self.budget, self.interrupt)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def interrupt(self):
+        self.ctx.stopped = True
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.thread is None:
+            return
+        self.interrupt()
+        self.release.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self, lines: TextIO = sys.stdin):
+        for line in lines:
+            if not self.handle(line):
+                break
+        self.stop()
+
+
+def main():
+    Engine().run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import List, Tuple
 from urllib.parse import quote_plus
 from webbrowser import open
 
@@ -7,35 +7,32 @@ def open_fen(fen: str):
     open("https://lichess.org/editor?fen=" + quote_plus(fen))
 
 
-def raycast(pos, index: int, direction: Tuple[int, int], color, limit: int = -1, allow_capture: bool = True):
-    if limit == 0:
-        return ()
-    next_index = index
-    if index % pos.board_width == pos.board_width - 1 and direction[0] == 1:
-        # we are moving into the right edge
-        return ()
+def square_name(pos, index: int) -> str:
+    return chr(index % pos.board_width + 97) + str(pos.board_height - index // pos.board_width)
 
-    if index % pos.board_width == 0 and direction[0] == -1:
-        # we are moving into the left edge
-        return ()
 
-    if index >= (pos.board_width - 1) * pos.board_height and direction[1] == 1:
-        # we are moving into the bottom
-        return ()
+def move_name(pos, move: Tuple[int, int]) -> str:
+    return square_name(pos, move[0]) + square_name(pos, move[1])
 
-    if index <= pos.board_width and direction[1] == -1:
-        # we are moving into the top
-        return ()
 
-    # x component
-    next_index += direction[0]
-    # y component
-    next_index += 8 * direction[1]
+def walk(board, ray: Tuple[int, ...], code: int) -> List[int]:
+    # squares along ray up to the first piece, including it if it's an enemy
+    # (enemies have the opposite sign to code)
+    moves = []
+    for square in ray:
+        p = board[square]
+        if p:
+            if p * code < 0:
+                moves.append(square)
+            break
+        moves.append(square)
+    return moves
 
-    if p := pos.board[next_index]:  # there is already a piece here
-        if p.color == color or not allow_capture:
-            return ()  # we can't move into our own team
-        else:
-            return (next_index,)  # if there's a guy here it's the last stop
 
-    return (next_index,) + raycast(pos, next_index, direction, color, limit - 1)
\ No newline at end of file
+def first_capture(board, ray: Tuple[int, ...], code: int) -> Tuple[int, ...]:
+    # the first piece along ray, if it's an enemy
+    for square in ray:
+        p = board[square]
+        if p:
+            return (square,) if p * code < 0 else ()
+    return ()
@@ -0,0 +1,62 @@
+from typing import Iterable
+
+from chest.models import Position, PieceType, PIECE_VALUES
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batch evaluation
+    np = None
+
+# int8 board encoding, the codes Position stores its board in: white pieces
+# positive, black pieces negative, 0 empty
+CODES = {t: t.value for t in PieceType}
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for batch evaluation")
+
+
+def board_array(pos: Position):
+    _require_numpy()
+    return np.frombuffer(pos.board, dtype=np.int8).copy()
+
+
+def board_arrays(positions: Iterable[Position]):
+    return np.stack([board_array(pos) for pos in positions])
+
+
+def child_boards(row, moves):
+    # boards after each (start, end) move from the position encoded in row
+    starts, ends = np.array(moves, dtype=np.intp).T
+    rows = np.repeat(row[None, :], len(moves), axis=0)
+    n = np.arange(len(moves))
+    rows[n, ends] = rows[n, starts]
+    rows[n, starts] = 0
+    return rows
+
+
+def material_table(squares: int = 64):
+    # table[code + 6, square] is the white-relative score of that piece on
+    # that square; piece-square terms are added on top of the material rows
+    _require_numpy()
+    values = np.zeros(13, dtype=np.int32)
+    for code in CODES.values():
+        values[6 + code] = PIECE_VALUES[code]
+        values[6 - code] = -PIECE_VALUES[code]
+    return np.repeat(values[:, None], squares, axis=1)
+
+
+_tables = {}
+
+
+def score_boards(boards, table=None):
+    # white-relative score of every row of an (N, squares) int8 batch; with
+    # the default table this equals score_pieces for each position
+    _require_numpy()
+    squares = boards.shape[1]
+    if table is None:
+        if squares not in _tables:
+            _tables[squares] = material_table(squares)
+        table = _tables[squares]
+    return table[boards.astype(np.intp) + 6, np.arange(squares)].sum(axis=1)
@@ -1,29 +1,17 @@
-from chest import evaluate
-from chest.models import Position, Color
-from chest.evaluate import evaluate, alphabeta_max, next_position, next_position2
+from chest.models import Color
+from chest.bitboard import BitboardPosition
+from chest.book import load_default
+from chest.evaluate import print_iteration
+from chest.session import GameSession
 from chest.utils import open_fen
-from math import inf
 
 if __name__ == '__main__':
-    position = Position.from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")
-    a, nextposition = next_position(position, Color.white, 6)
-    print(a, nextposition)
-    open_fen(str(nextposition))
-
-    score, nextposition = next_position(nextposition, Color.black, 5)
-    print(f"{position} -> {nextposition}")
-    print(f"score: {score}")
-    open_fen(str(nextposition))
-
-    score, nextposition = next_position(nextposition, Color.white, 4)
-    print(f"-> {nextposition}")
-    print(nextposition)
-    print(f"score: {score}")
-    open_fen(str(nextposition))
-
-    score, nextposition = next_position(nextposition, Color.black, 4)
-    print(f"-> {nextposition}")
-    print(nextposition)
-    print(f"score: {score}")
-    open_fen(str(nextposition))
- 
\ No newline at end of file
+    position = BitboardPosition.from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR")
+    # one session for the whole game, so each search starts from the tables the last ones filled
+    session = GameSession(position, Color.white, book=load_default())
+    for depth in (6, 5, 4, 4):
+        before = str(session.pos)
+        move, score = session.think(depth, on_iteration=print_iteration)
+        print(f"{before} -> {session.pos}")
+        print(f"score: {score}")
+        open_fen(str(session.pos))